@@ -1,11 +1,15 @@
+from app import startup  # first, to time the rest
 import os
 
 import connexion
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
 from jsonschema import draft4_format_checker
 
+from app.replica import RoutingSQLAlchemy
+
+startup.lap('imports')
+
 
 @draft4_format_checker.checks('latlon')
 def is_latlon(value):
@@ -17,13 +21,29 @@ connexion_app = connexion.App(__name__)
 app = connexion_app.app
 env = os.getenv('FLASK_ENV', 'development')
 app.config.from_object(f'app.config.{env.capitalize()}Config')
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)  # reads go to the replica where it's safe
 migrate = Migrate(app, db)
+startup.lap('config')
 # Must come last bc it jumps to init another module & will cause partial initialization
 ma = Marshmallow(connexion_app)
+from app.validation import SampledResponseValidator  # noqa: E402
+from app.serialization import OrjsonApi  # noqa: E402
+connexion_app.api_cls = OrjsonApi  # serializes responses w/ orjson
 connexion_app.add_api(
-    'swagger.yml',
+    startup.load_spec(os.path.join(connexion_app.specification_dir, 'swagger.yml'), {'config': app.config}),
     strict_validation=True,
     validate_responses=app.config['VALIDATE_RESPONSES'],
-    arguments={'config': app.config}
+    validator_map={'response': SampledResponseValidator}
 )
+startup.lap('api')
+# CLI commands, e.g. `flask routes archive`
+from app import partitions  # noqa: E402
+# Prometheus /metrics & the hooks collecting them
+from app import metrics  # noqa: E402
+# Opt-in per-request profiling
+from app import profiling  # noqa: E402
+# Compressed responses
+from app import compression  # noqa: E402
+# Static layers cached per data version & served w/ ETags
+from app import layers  # noqa: E402
+startup.lap('extensions')
@@ -0,0 +1,37 @@
+"""gzip/brotli compression of large responses."""
+import gzip
+
+import brotli
+from flask import request
+
+from app import app
+
+
+COMPRESSIBLE_TYPES = 'application/json', 'application/problem+json', 'text/plain', 'text/html'
+
+
+def accepted_encoding() -> str:
+    """The best encoding the client accepts, None if it accepts neither."""
+    return request.accept_encodings.best_match(['br', 'gzip'])
+
+
+def compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    """Compress w/ the configured level, or the best one, e.g. if it's done once for many responses."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else app.config['COMPRESSION_BROTLI_LEVEL'])
+    return gzip.compress(data, compresslevel=9 if best else app.config['COMPRESSION_GZIP_LEVEL'])
+
+
+@app.after_request
+def compress_response(response):
+    if (
+        response.direct_passthrough or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    if encoding and response.content_length and response.content_length >= app.config['COMPRESSION_MIN_SIZE']:
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
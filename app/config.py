@@ -7,8 +7,27 @@ class Config:
     CSRF_ENABLED = True
     SECRET_KEY = os.environ['SECRET_KEY']
     SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
+    # Read-only endpoints are served from the replica if one is set
+    SQLALCHEMY_BINDS = {'replica': os.environ['DATABASE_REPLICA_URL']} if os.getenv('DATABASE_REPLICA_URL') else {}
+    REPLICA_STICKY_SECONDS = 10  # clients read from the primary for up to this long after writing, see app.replica
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Size the pool for the number of requests a (gevent) worker serves at once, see gunicorn.conf.py
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_POOL_MAX_OVERFLOW', 20)),
+        'pool_timeout': 10,
+        'pool_pre_ping': True
+    }
     VALIDATE_RESPONSES = True
+    # Validate only some responses & their arrays' first items, e.g. to keep staging timings realistic
+    RESPONSE_VALIDATION_SAMPLE_RATE = float(os.getenv('RESPONSE_VALIDATION_SAMPLE_RATE', 1))  # a fraction
+    RESPONSE_VALIDATION_MAX_ITEMS = int(os.getenv('RESPONSE_VALIDATION_MAX_ITEMS', 0))  # 0 to check all items
+    # Responses are gzip/brotli compressed if they're at least this large
+    COMPRESSION_MIN_SIZE = 1024  # in bytes
+    COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))  # 1-9
+    COMPRESSION_BROTLI_LEVEL = int(os.getenv('COMPRESSION_BROTLI_LEVEL', 4))  # 0-11
+    # Static layers, e.g. all the stops, are cached per version of their tables & served w/ ETags
+    LAYER_VERSION_CHECK_INTERVAL = 60  # in seconds
     # The cartographic projection used to store and operate on spatial data
     PROJECTION = 32637  # https://epsg.io/32637
     # Business logic parameters
@@ -17,10 +36,62 @@ class Config:
     MAX_PREPARED_ROUTES = 2
     DROPOFF_RADIUS = 150  # in meters
     POINT_PROXIMITY_THRESHOLD = 1000  # in meters
+    CORRIDOR_CELL_SIZE = POINT_PROXIMITY_THRESHOLD  # in meters
     PICKUP_MAX_RADIUS = 1000
     PICKUP_MIN_RADIUS = 200
+    PICKUP_MAX_SUGGESTIONS = 5  # when ranked by time
+    PICKUP_DETOUR_SPEED = 8.3  # in m/s, to estimate the driver's detour to a stop
     ROUTE_BUFFER_SIZE = 50
-    GEO_ENGINE = os.environ['GEO_ENGINE']
+    # Pick-up & drop-off fences of the routes created within the last hours are held in memory,
+    # drivers' positions are evaluated against them in batches
+    GEOFENCE_ACTIVE_HOURS = 24
+    GEOFENCE_CELL_SIZE = 500  # in meters
+    GEOFENCE_RELOAD_INTERVAL = 300  # in seconds, for routes to age out; changed points are reloaded on their own
+    GEOFENCE_BATCH_INTERVAL = 5  # in seconds
+    # Route event streams
+    EVENTS_KEEPALIVE = 15  # in seconds
+    EVENTS_QUEUE_SIZE = 100  # events kept per stream for a client that's slow to read them
+    # Stops are served from memory; the index is rebuilt if the table has changed since
+    STOP_INDEX_CELL_SIZE = 500  # in meters
+    STOP_INDEX_CHECK_INTERVAL = 300  # in seconds
+    GEO_ENGINE = os.environ['GEO_ENGINE']  # ors, rumap or local
+    # Each request's calls to ORS, Pelias & rumap get the time left of its budget as timeouts, & are only retried
+    # while there's time left; once it's spent, the request fails w/ a 504
+    UPSTREAM_BUDGET = float(os.getenv('UPSTREAM_BUDGET', 10))  # in seconds
+    UPSTREAM_BUDGETS = {  # by handler in app.routes, where they differ from the above
+        'post_route': float(os.getenv('UPSTREAM_BUDGET_POST_ROUTE', 20)),
+        'batch_geocode': float(os.getenv('UPSTREAM_BUDGET_BATCH_GEOCODE', 30)),
+        'suggest': float(os.getenv('UPSTREAM_BUDGET_SUGGEST', 3)),  # typed ahead, stale soon
+    }
+    UPSTREAM_CONNECT_TIMEOUT = 3.05  # in seconds, a bit over a multiple of 3, TCP's retransmission window
+    UPSTREAM_RETRIES = 1  # of connection errors & 502-504s, e.g. while an upstream restarts
+    # rumap's key is rate limited & has a daily quota per endpoint, shared by all workers via the DB;
+    # calls go to ORS rather than rumap once either is used up
+    RUMAP_RATE_LIMIT = float(os.getenv('RUMAP_RATE_LIMIT', 10))  # calls per second, per endpoint
+    RUMAP_RATE_BURST = int(os.getenv('RUMAP_RATE_BURST', 20))
+    RUMAP_QUOTA_BATCH = int(os.getenv('RUMAP_QUOTA_BATCH', 10))  # calls reserved by a worker at a time
+    RUMAP_DAILY_QUOTAS = {
+        'routing': int(os.getenv('RUMAP_ROUTING_DAILY_QUOTA', 10000)),
+        'forward': int(os.getenv('RUMAP_FORWARD_DAILY_QUOTA', 10000)),  # geocoding & suggestions
+        'reverse': int(os.getenv('RUMAP_REVERSE_DAILY_QUOTA', 10000))
+    }
+    # Batch geocoding resolves unique texts concurrently, up to this many upstream calls at a time
+    GEOCODE_BATCH_CONCURRENCY = int(os.getenv('GEOCODE_BATCH_CONCURRENCY', 10))
+    # The local engine routes over the Road table in-process, and hands longer legs to ORS
+    LOCAL_ROUTING_MAX_DISTANCE = 5000  # in meters, as the crow flies
+    LOCAL_ROUTING_MAX_SNAP_DISTANCE = 200  # in meters, from a position to the nearest road vertex
+    LOCAL_ROUTING_MAX_SETTLED_NODES = 200000
+    LOCAL_ROUTING_CELL_SIZE = 200  # in meters
+    # Per-request profiling, triggered by an `X-Profile: <token>` header or for 1 in N requests
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '').lower() in ('1', 'true')
+    PROFILING_TOKEN = os.getenv('PROFILING_TOKEN')
+    PROFILING_SAMPLE_RATE = int(os.getenv('PROFILING_SAMPLE_RATE', 0))  # 0 to only profile on demand
+    PROFILING_DIR = os.getenv('PROFILING_DIR', '/tmp/profiles')
+    PROFILING_MAX_FILES = 100
+    # Route storage is partitioned by month; older partitions get detached by `flask routes archive`
+    ROUTE_PARTITIONS_AHEAD = 2  # in months
+    ROUTE_RETENTION_DAYS = int(os.getenv('ROUTE_RETENTION_DAYS', 90))
+    ROUTE_ARCHIVE_SCHEMA = os.getenv('ROUTE_ARCHIVE_SCHEMA', 'archive')  # empty string to drop instead
 
 
 class ProductionConfig(Config):
@@ -31,6 +102,8 @@ class ProductionConfig(Config):
 class StagingConfig(Config):
     DEVELOPMENT = True
     DEBUG = True
+    RESPONSE_VALIDATION_SAMPLE_RATE = float(os.getenv('RESPONSE_VALIDATION_SAMPLE_RATE', 0.1))
+    RESPONSE_VALIDATION_MAX_ITEMS = int(os.getenv('RESPONSE_VALIDATION_MAX_ITEMS', 20))
 
 
 class DevelopmentConfig(Config):
@@ -40,3 +113,4 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    LAYER_VERSION_CHECK_INTERVAL = 0
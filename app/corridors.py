@@ -0,0 +1,62 @@
+from datetime import datetime
+from uuid import uuid4
+
+from shapely.geometry import Point
+from geoalchemy2.shape import to_shape
+from sqlalchemy.dialects.postgresql import insert
+
+from app import app, db
+from app.models import Corridor, Route
+
+
+def cell(point: Point) -> str:
+    """Key of the grid cell a projected point falls into."""
+    size = app.config['CORRIDOR_CELL_SIZE']
+    return f'{int(point.x // size)}:{int(point.y // size)}'
+
+
+def neighborhood(point: Point) -> list[str]:
+    """The point's cell & those around it, so that points near a cell's edge still match."""
+    size = app.config['CORRIDOR_CELL_SIZE']
+    return [cell(Point(point.x + dx * size, point.y + dy * size)) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+def find(user_id, profile: str, start: Point, finish: Point) -> list[dict]:
+    """Get the user's corridors between projected `start` & `finish`, most driven first."""
+    threshold = app.config['POINT_PROXIMITY_THRESHOLD']
+    corridors = Corridor.query.filter(
+        Corridor.user_id == user_id,
+        Corridor.profile == profile,
+        Corridor.start_cell.in_(neighborhood(start)),
+        Corridor.finish_cell.in_(neighborhood(finish))
+    ).order_by(Corridor.trip_count.desc(), Corridor.updated_at.desc())
+    routes = []
+    for corridor in corridors:
+        geom = to_shape(corridor.geom)
+        # Cells are as large as the threshold, so neighbors may still be too far away
+        if Point(geom.coords[0]).distance(start) < threshold and Point(geom.coords[-1]).distance(finish) < threshold:
+            routes.append({'geometry': geom, 'distance': corridor.distance, 'duration': corridor.duration})
+        if len(routes) == app.config['MAX_PREPARED_ROUTES']:
+            break
+    return routes
+
+
+def record(route: Route):
+    """Add a driven route to its corridor, making it the corridor's representative route."""
+    geom = to_shape(route.geom)
+    values = {
+        'user_id': route.user_id,
+        'profile': route.profile,
+        'start_cell': cell(Point(geom.coords[0])),
+        'finish_cell': cell(Point(geom.coords[-1])),
+        'route_id': route.id,
+        'geom': route.geom,
+        'distance': route.distance,
+        'duration': route.duration,
+        'updated_at': datetime.utcnow()
+    }
+    statement = insert(Corridor).values(id=uuid4(), trip_count=1, **values)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['user_id', 'profile', 'start_cell', 'finish_cell'],
+        set_={**values, 'trip_count': Corridor.trip_count + 1}
+    ))
@@ -0,0 +1,71 @@
+"""Time budgets of requests' calls to ORS, Pelias & rumap.
+
+Each request gets a deadline when it starts, UPSTREAM_BUDGET or its operation's own budget later;
+upstream calls get the time left as their timeouts, & are only retried while there's time left.
+Once it's spent, the request fails fast w/ a 504 rather than keeping the worker waiting.
+"""
+import time
+
+import requests
+from flask import g, abort, has_app_context
+
+from app import app, metrics
+
+
+RETRY_STATUSES = 502, 503, 504
+
+
+def set_to(at: float):
+    """Set the deadline, e.g. in threads serving the request, to that of the request."""
+    g.deadline = at
+
+
+def get() -> float:
+    """The current deadline, as `time.monotonic()`."""
+    if not (has_app_context() and 'deadline' in g):
+        return time.monotonic() + app.config['UPSTREAM_BUDGET']  # e.g. in CLI commands
+    return g.deadline
+
+
+def left() -> float:
+    """Seconds left till the deadline."""
+    return get() - time.monotonic()
+
+
+def expired():
+    abort(504, 'Upstream services took too long to respond; try again later')
+
+
+def timeout() -> tuple:
+    """(connect, read) timeouts for an upstream call, w/ the 504 raised if there's no time left."""
+    seconds = left()
+    if seconds <= 0:
+        expired()
+    return min(app.config['UPSTREAM_CONNECT_TIMEOUT'], seconds), seconds
+
+
+def send(method: str, url: str, **kwargs) -> requests.Response:
+    """Same as `requests.request`, w/ the time left as timeouts & retries of unavailable upstreams while it lasts."""
+    retries = app.config['UPSTREAM_RETRIES']
+    for attempt in range(retries + 1):
+        try:
+            res = requests.request(method, url, timeout=timeout(), **kwargs)
+        except requests.Timeout:
+            expired()
+        except requests.ConnectionError:
+            if attempt == retries:
+                raise
+            if left() < app.config['UPSTREAM_CONNECT_TIMEOUT']:  # no time for another attempt
+                expired()
+            continue
+        if res.status_code not in RETRY_STATUSES or attempt == retries:
+            return res
+        res.close()  # to reuse the connection
+        if left() < app.config['UPSTREAM_CONNECT_TIMEOUT']:
+            expired()
+
+
+@app.before_request
+def start_request():
+    operation = metrics.operation().replace('app_routes_', '', 1)  # i.e. the handler's name in app.routes
+    set_to(time.monotonic() + app.config['UPSTREAM_BUDGETS'].get(operation, app.config['UPSTREAM_BUDGET']))
@@ -0,0 +1,131 @@
+"""Route events, e.g. remainder updates, published via Postgres NOTIFY & fanned out to streams in each worker.
+
+Notifications only carry a route id & the event's name: each worker listening to them loads the
+event's data once, however many of its clients are subscribed to the route.
+"""
+import time
+import queue
+import select
+import threading
+from collections import defaultdict
+
+import psycopg2
+from sqlalchemy import text
+from geojson import Feature
+from geoalchemy2.shape import to_shape
+
+from app import app, db
+from app.helpers import to_wgs84
+from app.models import Route, PickupPoint, DropoffPoint
+
+
+CHANNEL = 'route_events'
+EVENTS = 'remainder', 'pickup_point', 'dropoff_point'
+
+_subscribers = defaultdict(set)  # route id -> queues of its subscribers
+_handlers = []  # called w/ the route id & event of each notification, e.g. to drop data cached in the worker
+_lock = threading.Lock()
+_listener = None
+
+
+def publish(route_id, event: str):
+    """Notify every worker's subscribers of the route's event, once the current transaction commits."""
+    db.session.execute(text('SELECT pg_notify(:channel, :payload)'), {
+        'channel': CHANNEL, 'payload': f'{route_id} {event}'
+    })
+
+
+def load(route_id, event: str):
+    """The event's data: the remainder as a feature, or a point's [lon, lat]; None if there's none."""
+    if event == 'remainder':
+        geom = db.session.query(Route.geom_remainder).filter(Route.id == route_id).scalar()
+        if geom is None:
+            return None
+        remainder = to_shape(geom)
+        return Feature(route_id, to_wgs84(remainder), {'distance': round(remainder.length)})
+    model = PickupPoint if event == 'pickup_point' else DropoffPoint
+    geom = db.session.query(model.geom).filter(model.route_id == route_id).scalar()
+    return list(to_wgs84(to_shape(geom)).coords[0]) if geom is not None else None
+
+
+def on_notify(handler):
+    """Have the handler called w/ every notification this worker gets, once it's listening, see `start`."""
+    _handlers.append(handler)
+    return handler
+
+
+def dispatch(route_id: str, event: str):
+    for handler in _handlers:
+        handler(route_id, event)
+    subscribers = list(_subscribers.get(route_id, ()))
+    if not subscribers:
+        return
+    with app.app_context():
+        try:
+            data = load(route_id, event)
+        finally:
+            db.session.remove()  # incl. after a failure, which would leave the listener's session unusable
+    for subscriber in subscribers:
+        try:
+            subscriber.put_nowait((route_id, event, data))
+        except queue.Full:  # the client isn't reading; it'll catch up w/ later events
+            pass
+
+
+def listen():
+    """Relay notifications to this worker's subscribers, reconnecting if the connection drops."""
+    while True:
+        connection = None
+        try:
+            with app.app_context():  # a connection of its own, as it's held for as long as the worker lives
+                dialect, url = db.engine.dialect, db.engine.url
+                args, kwargs = dialect.create_connect_args(url)
+                connection = dialect.connect(*args, **kwargs)
+            connection.autocommit = True
+            connection.cursor().execute(f'LISTEN {CHANNEL}')
+            while True:
+                if select.select([connection], [], [], 60) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    payload = connection.notifies.pop(0).payload
+                    try:  # a notification that fails mustn't stop the others
+                        route_id, event = payload.split()
+                        dispatch(route_id, event)
+                    except Exception:
+                        app.logger.exception(f'Failed to dispatch route event {payload!r}')
+        except Exception:
+            app.logger.exception('Route events listener failed, reconnecting')
+            time.sleep(1)
+        finally:
+            if connection is not None:
+                try:
+                    connection.close()
+                except psycopg2.Error:
+                    pass
+
+
+def start():
+    """Start listening in this worker, unless it already is; a listener started before forking doesn't carry over."""
+    global _listener
+    with _lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = threading.Thread(target=listen, name='route-events', daemon=True)
+            _listener.start()
+
+
+def subscribe(*route_ids) -> queue.Queue:
+    subscriber = queue.Queue(maxsize=app.config['EVENTS_QUEUE_SIZE'])
+    start()
+    with _lock:
+        for route_id in route_ids:
+            _subscribers[str(route_id)].add(subscriber)
+    return subscriber
+
+
+def unsubscribe(subscriber: queue.Queue, *route_ids):
+    with _lock:
+        for route_id in route_ids:
+            _subscribers[str(route_id)].discard(subscriber)
+            if not _subscribers[str(route_id)]:
+                del _subscribers[str(route_id)]
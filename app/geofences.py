@@ -0,0 +1,185 @@
+"""Pick-up & drop-off fences of active passenger routes, & drivers' positions evaluated against them.
+
+The fences, i.e. the points & DROPOFF_RADIUS around them, are held in memory, so telling whether a
+driver is at one is a lookup. A route's fences are reloaded on their own once its points change, as
+notified via app.events, & all of them every GEOFENCE_RELOAD_INTERVAL, for routes to age out.
+Positions posted w/ remainders are buffered & evaluated in batches, recording the drivers entering &
+leaving the fences as GeofenceEvents.
+"""
+import time
+import threading
+from uuid import uuid4
+from datetime import datetime, timedelta
+
+import numpy as np
+from geoalchemy2.shape import to_shape
+
+from app import app, db, events
+from app.grid import GridIndex
+from app.models import PickupPoint, DropoffPoint, GeofenceEvent
+
+
+FENCES = {'pickup': PickupPoint, 'dropoff': DropoffPoint}
+EVENTS = {'pickup_point': 'pickup', 'dropoff_point': 'dropoff'}  # route event -> kind of fence it changes
+
+
+class FenceIndex(GridIndex):
+    """Fences as (route id, kind), indexed by their centres."""
+    def __init__(self, fences: list, coords: np.ndarray, radius: float, cell_size: float):
+        super().__init__(coords, cell_size)
+        self.fences = fences
+        self.positions = {fence: i for i, fence in enumerate(fences)}
+        self.radius = radius
+
+    def containing(self, x: float, y: float) -> list:
+        return [self.fences[i] for i in self.within(x, y, self.radius)]
+
+    def contains(self, route_id, kind: str, x: float, y: float):
+        """Whether the position is in the route's fence, None if the route has no such fence."""
+        i = self.positions.get((str(route_id), kind))
+        if i is None:
+            return None
+        return bool(np.hypot(*(self.coords[i] - (x, y))) < self.radius)
+
+
+_index = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+_changed = set()  # (route id, kind) of the fences changed since they were loaded
+_changed_lock = threading.Lock()
+_pings = []  # (driver's route id, x, y, time) to evaluate
+_pings_lock = threading.Lock()
+_flusher = None
+
+
+def load() -> FenceIndex:
+    """Read the fences of the routes created within GEOFENCE_ACTIVE_HOURS into a fresh index."""
+    global _index, _loaded_at
+    events.start()  # to hear of changed points
+    with _lock:
+        with _changed_lock:  # read below as they are now
+            _changed.clear()
+        active_since = datetime.utcnow() - timedelta(hours=app.config['GEOFENCE_ACTIVE_HOURS'])
+        fences = []
+        for kind, model in FENCES.items():
+            query = db.session.query(model.route_id, model.geom).filter(model.route_created_at >= active_since)
+            fences += [((str(route_id), kind), to_shape(geom).coords[0]) for route_id, geom in query]
+        coords = np.array([point for _, point in fences], dtype=np.float64).reshape(-1, 2)
+        _index = FenceIndex(
+            [fence for fence, _ in fences], coords, app.config['DROPOFF_RADIUS'], app.config['GEOFENCE_CELL_SIZE']
+        )
+        _loaded_at = time.monotonic()
+    return _index
+
+
+def update() -> FenceIndex:
+    """Reload just the changed fences, adding, replacing or removing them, into a fresh index."""
+    global _index
+    with _lock:
+        with _changed_lock:
+            changed = set(_changed)
+            _changed.clear()
+        if not changed:  # updated by another thread meanwhile
+            return _index
+        kept = [i for i, fence in enumerate(_index.fences) if fence not in changed]
+        fences, coords = [_index.fences[i] for i in kept], [_index.coords[kept]]
+        active_since = datetime.utcnow() - timedelta(hours=app.config['GEOFENCE_ACTIVE_HOURS'])
+        for kind, model in FENCES.items():
+            route_ids = [route_id for route_id, changed_kind in changed if changed_kind == kind]
+            if not route_ids:
+                continue
+            query = db.session.query(model.route_id, model.geom).filter(
+                model.route_id.in_(route_ids), model.route_created_at >= active_since
+            )
+            for route_id, geom in query:
+                fences.append((str(route_id), kind))
+                coords.append(np.array([to_shape(geom).coords[0]], dtype=np.float64))
+        _index = FenceIndex(fences, np.vstack(coords), _index.radius, _index.cell_size)
+    return _index
+
+
+def get() -> FenceIndex:
+    """Get the fence index, reloading it all when it's due, or the fences that have changed since."""
+    if _index is None or time.monotonic() - _loaded_at > app.config['GEOFENCE_RELOAD_INTERVAL']:
+        return load()
+    if _changed:
+        return update()
+    return _index
+
+
+@events.on_notify
+def point_changed(route_id: str, event: str):
+    """Have the route's fence reloaded when it's next used.
+
+    Changes made by any worker are notified to all of them, see app.routes.save_route_point; the
+    worker making one calls this as well, to see it w/out waiting for the notification.
+    """
+    if event in EVENTS:
+        with _changed_lock:
+            _changed.add((str(route_id), EVENTS[event]))
+
+
+def contains(route_id, kind: str, x: float, y: float):
+    """Whether the position is in the route's fence, None if the route has no such fence."""
+    return get().contains(route_id, kind, x, y)
+
+
+def evaluate(pings: list):
+    """Record the drivers entering & leaving fences, given their positions in the order they came."""
+    index = get()
+    drivers = {driver for driver, *_ in pings}
+    # Fences each driver is in, as of their latest events
+    latest = db.session.query(
+        GeofenceEvent.driver_route_id, GeofenceEvent.route_id, GeofenceEvent.fence, GeofenceEvent.event
+    ).filter(GeofenceEvent.driver_route_id.in_(drivers)).distinct(
+        GeofenceEvent.driver_route_id, GeofenceEvent.route_id, GeofenceEvent.fence
+    ).order_by(
+        GeofenceEvent.driver_route_id, GeofenceEvent.route_id, GeofenceEvent.fence, GeofenceEvent.created_at.desc()
+    )
+    inside = {driver: set() for driver in drivers}
+    for driver, route_id, kind, event in latest:
+        if event == 'enter':
+            inside[str(driver)].add((str(route_id), kind))
+    events = []
+    for driver, x, y, created_at in pings:
+        fences = set(index.containing(x, y))
+        for (route_id, kind), event in [(fence, 'enter') for fence in fences - inside[driver]] + [
+            (fence, 'exit') for fence in inside[driver] - fences
+        ]:
+            events.append({
+                'id': uuid4(), 'route_id': route_id, 'fence': kind, 'driver_route_id': driver, 'event': event,
+                'created_at': created_at
+            })
+        inside[driver] = fences
+    if events:
+        db.session.execute(GeofenceEvent.__table__.insert(), events)
+        db.session.commit()
+
+
+def flush():
+    """Evaluate the buffered positions every GEOFENCE_BATCH_INTERVAL."""
+    while True:
+        time.sleep(app.config['GEOFENCE_BATCH_INTERVAL'])
+        with _pings_lock:
+            pings = _pings[:]
+            del _pings[:]
+        if not pings:
+            continue
+        with app.app_context():
+            try:
+                evaluate(pings)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception(f'Failed to evaluate {len(pings)} positions against geofences')
+            finally:
+                db.session.remove()
+
+
+def record(driver_route_id, x: float, y: float):
+    """Buffer the driver's position to be evaluated w/ the next batch."""
+    global _flusher
+    with _pings_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=flush, name='geofences', daemon=True)
+            _flusher.start()
+        _pings.append((str(driver_route_id), x, y, datetime.utcnow()))
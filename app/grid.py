@@ -0,0 +1,62 @@
+import numpy as np
+
+
+class GridIndex:
+    """In-memory grid index of points in projected coordinates.
+
+    Points are ordered by grid cell (column-major), so the points of a column's range of cells
+    form one contiguous slice; queries return indices into the original `coords`.
+    """
+    def __init__(self, coords: np.ndarray, cell_size: float):
+        self.coords = coords
+        self.cell_size = cell_size
+        self.origin = coords.min(axis=0) if len(coords) else np.zeros(2)
+        cells = self._cells(coords)
+        self.cols = int(cells[:, 0].max()) + 1 if len(coords) else 1
+        self.rows = int(cells[:, 1].max()) + 1 if len(coords) else 1
+        keys = cells[:, 0] * self.rows + cells[:, 1]
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.coords)
+
+    def _cells(self, coords: np.ndarray) -> np.ndarray:
+        return np.floor((coords - self.origin) / self.cell_size).astype(np.int64).reshape(-1, 2)
+
+    def _candidates(self, min_x: float, min_y: float, max_x: float, max_y: float) -> np.ndarray:
+        """Indices of the points in the grid cells overlapping the box."""
+        (col_from, row_from), (col_to, row_to) = self._cells(np.array([[min_x, min_y], [max_x, max_y]]))
+        col_from, col_to = max(col_from, 0), min(col_to, self.cols - 1)
+        row_from, row_to = max(row_from, 0), min(row_to, self.rows - 1)
+        if row_from > row_to or col_from > col_to:
+            return np.empty(0, dtype=np.int64)
+        slices = [
+            self.order[slice(*np.searchsorted(self.keys, [col * self.rows + row_from, col * self.rows + row_to + 1]))]
+            for col in range(col_from, col_to + 1)
+        ]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def within(self, x: float, y: float, radius: float) -> np.ndarray:
+        """Indices of the points within `radius` from (x, y), nearest first."""
+        candidates = self._candidates(x - radius, y - radius, x + radius, y + radius)
+        distances = np.hypot(*(self.coords[candidates] - (x, y)).T)
+        order = np.argsort(distances, kind='stable')
+        return candidates[order][distances[order] <= radius]
+
+    def nearest(self, x: float, y: float, k: int = 1) -> np.ndarray:
+        """Indices of the `k` points nearest to (x, y), nearest first."""
+        k = min(k, len(self))
+        radius = self.cell_size
+        while True:
+            found = self.within(x, y, radius)
+            # Once k points are found within a circle, no point outside of it can be among the k nearest
+            if len(found) >= k:
+                return found[:k]
+            radius *= 2
+
+    def in_bbox(self, min_x: float, min_y: float, max_x: float, max_y: float) -> np.ndarray:
+        """Indices of the points inside the box."""
+        candidates = self._candidates(min_x, min_y, max_x, max_y)
+        x, y = self.coords[candidates].T
+        return candidates[(x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)]
@@ -1,29 +1,49 @@
 import math
+from datetime import datetime
+from functools import lru_cache
 from typing import Iterable, Sequence
 
 import pyproj
 from geojson import Feature
-from geoalchemy2.shape import to_shape
+from geoalchemy2.shape import to_shape, from_shape
 from shapely.ops import transform
+from sqlalchemy import bindparam, cast, select, union_all, text
 
-from app import app
-from app.schemas import RouteSchema
+from app import app, db, replica
 from app.models import Route
 
 
-route_schema = RouteSchema()
-_project = pyproj.Transformer.from_crs(4326, app.config['PROJECTION'], always_xy=True).transform
-_to_wgs84 = pyproj.Transformer.from_crs(app.config['PROJECTION'], 4326, always_xy=True).transform
+# Both take a while to build, so it's done on first use rather than on import
+@lru_cache(maxsize=None)
+def transformer(from_crs: int, to_crs: int) -> pyproj.Transformer:
+    return pyproj.Transformer.from_crs(from_crs, to_crs, always_xy=True)
+
+
+@lru_cache(maxsize=None)
+def route_schema():
+    from app.schemas import RouteSchema  # introspects the model on import
+    return RouteSchema()
 
 
 def project(shape):
     """Project spherical coordinates."""
-    return shape if shape.is_empty else transform(_project, shape)
+    return shape if shape.is_empty else transform(transformer(4326, app.config['PROJECTION']).transform, shape)
 
 
 def to_wgs84(shape):
     "Transform planar coordinates to spherical (WGS84)."
-    return shape if shape.is_empty else transform(_to_wgs84, shape)
+    return shape if shape.is_empty else transform(transformer(app.config['PROJECTION'], 4326).transform, shape)
+
+
+def table_version(model) -> int:
+    """A number bumped by any write to the model's table, e.g. to tell if data cached from it is stale.
+
+    The counters are only kept on the primary, hence queried via the engine rather than the (routing) session.
+    """
+    return db.engine.execute(
+        text('SELECT n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables WHERE relname = :table'),
+        table=model.__tablename__
+    ).scalar()
 
 
 def parse_lat_lon(lat_lon: str) -> Iterable:
@@ -44,4 +64,36 @@ def haversine(from_: Sequence, to_: Sequence) -> float:
 
 def route_to_feature(route: Route) -> Feature:
     """Convert a PostGIS route record to GeoJSON."""
-    return Feature(route.id, to_wgs84(to_shape(route.geom)), route_schema.dump(route))
+    return Feature(route.id, to_wgs84(to_shape(route.geom)), route_schema().dump(route))
+
+
+def insert_routes(routes: list[dict]):
+    """Insert routes in a single statement.
+
+    Each route is a dict of Route's attributes, its `geom` being a projected shape. Geometries are
+    sent once each as EWKB, and the remainder is copied from the route's geometry by Postgres.
+    """
+    columns = ['id', 'user_id', 'profile', 'distance', 'duration', 'is_handled', 'created_at', 'geom']
+    table = Route.__table__
+    created_at = datetime.utcnow()
+    rows = union_all(*[
+        select([
+            # Values are cast so that Postgres doesn't take them for text when reading the union
+            cast(bindparam(f'{column}_{n}', value, type_=table.c[column].type), table.c[column].type).label(column)
+            for column, value in (
+                ('id', route['id']),
+                ('user_id', route['user_id']),
+                ('profile', route['profile']),
+                ('distance', route.get('distance')),
+                ('duration', route.get('duration')),
+                ('is_handled', route.get('is_handled', False)),
+                ('created_at', created_at),
+                ('geom', from_shape(route['geom'], srid=app.config['PROJECTION'], extended=True))
+            )
+        ]) for n, route in enumerate(routes)
+    ]).alias('rows')
+    db.session.execute(table.insert().from_select(
+        columns + ['geom_remainder'],
+        select([rows.c[column] for column in columns] + [rows.c.geom.label('geom_remainder')])
+    ))
+    replica.mark_written()
@@ -0,0 +1,80 @@
+"""Cache of static layers' ready responses, w/ validators for conditional GETs.
+
+Static layers, i.e. the full areas & stops layers, only change w/ the reference data, so they're
+serialized & compressed once per version of their table rather than once per request, & clients
+that already have the current data get a 304.
+"""
+import time
+import hashlib
+from datetime import datetime
+
+from flask import g, request, Response
+
+from app import app, metrics
+from app.compression import accepted_encoding, compress
+from app.helpers import table_version
+from app.models import Aoi, PublicTransportStop
+
+
+# By operation; a layer is only static if it's requested w/out params, e.g. the stops' bbox
+STATIC_LAYERS = {'app_routes_get_areas': Aoi, 'app_routes_get_stops': PublicTransportStop}
+
+_layers = {}  # (operation, encoding) -> (table version, response body, content type, ETag)
+_modified = {}  # operation -> (ETag, when it was first served)
+_versions = {}  # model -> (version, checked at)
+
+
+def static_layer():
+    """Model whose table the requested layer is made of, None if it's not a static layer."""
+    return None if request.args else STATIC_LAYERS.get(metrics.operation())
+
+
+def layer_version(model) -> int:
+    """Version of the model's table, checked against the DB at most every LAYER_VERSION_CHECK_INTERVAL."""
+    version, checked_at = _versions.get(model, (None, 0.0))
+    if time.monotonic() - checked_at > app.config['LAYER_VERSION_CHECK_INTERVAL']:
+        version = table_version(model)
+        _versions[model] = version, time.monotonic()
+    return version
+
+
+def layer_response(body: bytes, content_type: str, etag: str, encoding: str) -> Response:
+    response = Response(body, content_type=content_type)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # Weak, as it's the same for each encoding of the data
+    response.set_etag(etag, weak=True)
+    response.last_modified = _modified[metrics.operation()][1]
+    response.cache_control.no_cache = True  # may be kept by clients, but only used once revalidated
+    return response.make_conditional(request)
+
+
+@app.before_request
+def serve_static_layer():
+    model = static_layer()
+    if model is None:
+        return
+    # Taken before the layer is read, so that a write in between makes it stale rather than lost
+    g.layer_version = layer_version(model)
+    encoding = accepted_encoding()
+    cached = _layers.get((metrics.operation(), encoding))
+    if cached and cached[0] == g.layer_version:
+        del g.layer_version  # nothing to cache then
+        return layer_response(*cached[1:], encoding)
+
+
+@app.after_request
+def cache_static_layer(response):
+    """Runs before compress_response, being registered after it."""
+    if 'layer_version' not in g or response.status_code != 200:
+        return response
+    body = response.get_data()
+    etag = hashlib.sha1(body).hexdigest()
+    if _modified.get(metrics.operation(), (None,))[0] != etag:
+        _modified[metrics.operation()] = etag, datetime.utcnow().replace(microsecond=0)
+    encoding = accepted_encoding()
+    if encoding:
+        body = compress(body, encoding, best=True)
+    _layers[metrics.operation(), encoding] = g.layer_version, body, response.content_type, etag
+    return layer_response(body, response.content_type, etag, encoding)
@@ -0,0 +1,219 @@
+"""In-process routing over the `Road` table, for legs short enough not to need ORS.
+
+The road network is read once into a CSR graph (NumPy arrays): nodes are road vertices, merged
+if they coincide, and every segment between consecutive vertices is an edge in both directions.
+Legs are routed w/ bidirectional A*; anything the graph can't serve well goes to ORS.
+"""
+import heapq
+import threading
+
+import numpy as np
+from geoalchemy2.shape import to_shape
+
+from app import app, ors, metrics
+from app.grid import GridIndex
+from app.helpers import transformer
+from app.models import Road
+
+
+# Speeds in m/s by road type (OSM `highway`), None where the profile isn't allowed
+SPEEDS = {
+    'driving-car': {
+        'motorway': 25.0, 'motorway_link': 16.7, 'trunk': 22.2, 'trunk_link': 13.9,
+        'primary': 16.7, 'primary_link': 11.1, 'secondary': 13.9, 'secondary_link': 11.1,
+        'tertiary': 11.1, 'tertiary_link': 8.3, 'unclassified': 8.3, 'residential': 8.3,
+        'living_street': 2.8, 'service': 4.2,
+        'footway': None, 'pedestrian': None, 'path': None, 'steps': None, 'cycleway': None,
+        None: 8.3  # any other type
+    },
+    'foot-walking': {
+        'motorway': None, 'motorway_link': None, 'trunk': None, 'trunk_link': None,
+        None: 1.4
+    }
+}
+NODE_PRECISION = 0.1  # in meters; vertices closer than this are one node
+
+
+class RoadGraph:
+    """Road network as a CSR graph w/ edge costs (travel times in seconds) per profile."""
+    def __init__(self, roads: list):
+        """`roads` are (type, projected coordinates) pairs."""
+        types = list({type_ for type_, _ in roads})
+        vertices = np.concatenate([coords for _, coords in roads]) if roads else np.empty((0, 2))
+        road_of_vertex = np.repeat(np.arange(len(roads)), [len(coords) for _, coords in roads])
+        _, first, inverse = np.unique(
+            np.round(vertices / NODE_PRECISION).astype(np.int64), axis=0, return_index=True, return_inverse=True
+        )
+        self.coords = vertices[first]
+        to_wgs84 = transformer(app.config['PROJECTION'], 4326).transform
+        self.wgs84 = np.column_stack(to_wgs84(*self.coords.T)) if len(first) else np.empty((0, 2))
+        # Segments join consecutive vertices of the same road
+        is_segment = road_of_vertex[:-1] == road_of_vertex[1:]
+        source, target = inverse[:-1][is_segment], inverse[1:][is_segment]
+        type_codes = np.array([types.index(type_) for type_, _ in roads], dtype=np.int64)
+        edge_types = type_codes[road_of_vertex[:-1][is_segment]]
+        lengths = np.hypot(*(vertices[1:] - vertices[:-1])[is_segment].T)
+        is_loop = source == target
+        source, target, edge_types, lengths = (a[~is_loop] for a in (source, target, edge_types, lengths))
+        # The table has no one-way info, so each segment can be travelled both ways
+        source, target = np.concatenate([source, target]), np.concatenate([target, source])
+        edge_types, lengths = np.tile(edge_types, 2), np.tile(lengths, 2)
+        order = np.argsort(source, kind='stable')
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(source, minlength=len(self.coords)))])
+        self.indices = target[order]
+        self.lengths = lengths[order]
+        self.costs, self.max_speeds = {}, {}
+        for profile, speeds in SPEEDS.items():
+            type_speeds = np.array([speeds.get(type_, speeds[None]) or 0.0 for type_ in types] or [0.0])
+            edge_speeds = type_speeds[edge_types[order]]
+            with np.errstate(divide='ignore'):
+                self.costs[profile] = np.where(edge_speeds > 0, self.lengths / edge_speeds, np.inf)
+            self.max_speeds[profile] = max(speed for speed in speeds.values() if speed)
+        self.nodes = GridIndex(self.coords, app.config['LOCAL_ROUTING_CELL_SIZE'])
+
+    def snap(self, x: float, y: float) -> int:
+        """Nearest node to a projected position, None if too far to be on the network."""
+        found = self.nodes.within(x, y, app.config['LOCAL_ROUTING_MAX_SNAP_DISTANCE'])
+        return int(found[0]) if len(found) else None
+
+    def shortest_path(self, source: int, target: int, profile: str) -> tuple:
+        """(Nodes, edges, duration) of the path from `source` to `target`, None if not found within the limit.
+
+        Both searches use the average of the forward & backward straight-line potentials, which keeps
+        them consistent w/ each other, so they can stop as soon as their frontiers' keys sum up to
+        the best path found so far.
+        """
+        if source == target:
+            return [source], [], 0.0
+        coords, indptr, indices, costs = self.coords, self.indptr, self.indices, self.costs[profile]
+        speed = self.max_speeds[profile]
+        source_xy, target_xy = coords[source], coords[target]
+
+        def potential(node):  # forward one; the backward search uses its negation
+            x, y = coords[node]
+            return (
+                ((x - target_xy[0]) ** 2 + (y - target_xy[1]) ** 2) ** .5
+                - ((x - source_xy[0]) ** 2 + (y - source_xy[1]) ** 2) ** .5
+            ) / speed / 2
+
+        costs_so_far = ({source: 0.0}, {target: 0.0})
+        parents = ({source: None}, {target: None})
+        settled = (set(), set())
+        queues = ([(potential(source), source)], [(-potential(target), target)])
+        best, meeting = np.inf, None
+        limit = app.config['LOCAL_ROUTING_MAX_SETTLED_NODES']
+        while queues[0] and queues[1]:
+            if queues[0][0][0] + queues[1][0][0] >= best:
+                break
+            if len(settled[0]) + len(settled[1]) > limit:
+                return None
+            # Expand the smaller frontier
+            side = 0 if len(queues[0]) <= len(queues[1]) else 1
+            sign = 1 if side == 0 else -1
+            _, node = heapq.heappop(queues[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+            cost = costs_so_far[side][node]
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbour, new_cost = int(indices[edge]), cost + costs[edge]
+                if new_cost == np.inf or new_cost >= costs_so_far[side].get(neighbour, np.inf):
+                    continue
+                costs_so_far[side][neighbour] = new_cost
+                parents[side][neighbour] = node, edge
+                heapq.heappush(queues[side], (new_cost + sign * potential(neighbour), neighbour))
+                if neighbour in costs_so_far[1 - side] and new_cost + costs_so_far[1 - side][neighbour] < best:
+                    best, meeting = new_cost + costs_so_far[1 - side][neighbour], neighbour
+        if meeting is None:
+            return None
+        nodes, edges = [meeting], []
+        for side in (0, 1):
+            node = meeting
+            while parents[side][node] is not None:
+                node, edge = parents[side][node]
+                nodes.append(node)
+                # Backward searches take edges from `node`, whose twins have the same lengths
+                edges.append(edge)
+            if side == 0:
+                nodes.reverse()
+                edges.reverse()
+        return nodes, edges, best
+
+    def route(self, start: list, finish: list, profile: str) -> dict:
+        """Route between two [lon, lat] positions, None if it should be left to ORS."""
+        (start_x, finish_x), (start_y, finish_y) = transformer(4326, app.config['PROJECTION']).transform(
+            [start[0], finish[0]], [start[1], finish[1]]
+        )
+        if np.hypot(finish_x - start_x, finish_y - start_y) > app.config['LOCAL_ROUTING_MAX_DISTANCE']:
+            return None
+        source, target = self.snap(start_x, start_y), self.snap(finish_x, finish_y)
+        if source is None or target is None:
+            return None
+        found = self.shortest_path(source, target, profile)
+        if found is None:
+            return None
+        path, edges, duration = found
+        # Get to & from the network at the profile's default speed
+        access = (
+            np.hypot(*(self.coords[source] - (start_x, start_y)))
+            + np.hypot(*(self.coords[target] - (finish_x, finish_y)))
+        )
+        return {
+            'geometry': [list(start), *self.wgs84[path].tolist(), list(finish)],
+            'distance': float(self.lengths[edges].sum() + access),
+            'duration': float(duration + access / SPEEDS[profile][None])
+        }
+
+
+_graph = None
+_lock = threading.Lock()
+
+
+def load() -> RoadGraph:
+    """Read the road network from the DB into a fresh graph."""
+    global _graph
+    with _lock:
+        roads = [(road.type, np.asarray(to_shape(road.geom).coords)[:, :2]) for road in Road.query.all()]
+        _graph = RoadGraph(roads)
+    return _graph
+
+
+def get() -> RoadGraph:
+    return _graph if _graph is not None else load()
+
+
+def directions(
+    positions: list[list[float]],
+    profile: str,
+    alternatives: bool = False,
+    geometry: bool = True
+) -> list[dict]:
+    """Same as `ors.directions`, but served from the local graph if every leg is short enough."""
+    if alternatives or profile not in SPEEDS:
+        return ors.directions(positions, profile, alternatives, geometry)
+    graph, legs = get(), []
+    with metrics.upstream('local', 'directions') as call:
+        for start, finish in zip(positions, positions[1:]):
+            leg = graph.route(start, finish, profile)
+            if leg is None:
+                call['status'] = 'fallback'
+                break
+            legs.append(leg)
+    if len(legs) < len(positions) - 1:
+        return ors.directions(positions, profile, alternatives, geometry)
+    return [{
+        'geometry': [position for leg in legs for position in leg['geometry'][:-1]] + [legs[-1]['geometry'][-1]]
+        if geometry else positions,
+        'distance': sum(leg['distance'] for leg in legs),
+        'duration': sum(leg['duration'] for leg in legs)
+    }]
+
+
+# The local engine doesn't geocode
+geocode, suggest, reverse_geocode = ors.geocode, ors.suggest, ors.reverse_geocode
+
+
+@app.before_first_request
+def warm_up():
+    if app.config['GEO_ENGINE'] == 'local':
+        get()
@@ -0,0 +1,109 @@
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+
+from app import app, db
+
+
+# Gunicorn workers are separate processes, so their samples are aggregated via files in this dir
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+REQUEST_DURATION = Histogram(
+    'geo_request_duration_seconds', 'API request handling time', ['operation', 'method', 'status']
+)
+SQL_DURATION = Histogram(
+    'geo_sql_statement_duration_seconds', 'SQL statement execution time', ['operation'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, float('inf'))
+)
+SQL_STATEMENTS = Histogram(
+    'geo_sql_statements_per_request', 'Number of SQL statements a request executes', ['operation'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, float('inf'))
+)
+UPSTREAM_DURATION = Histogram(
+    'geo_upstream_request_duration_seconds', 'Time spent on calls to ORS, Pelias & rumap',
+    ['engine', 'method', 'status']
+)
+UPSTREAM_COALESCED = Counter(
+    'geo_upstream_coalesced_calls', 'Calls to ORS, Pelias & rumap that shared an identical one in flight',
+    ['engine', 'function']
+)
+DB_POOL = Gauge(
+    'geo_db_pool_connections', 'DB connection pool usage', ['bind', 'state'], multiprocess_mode='livesum'
+)
+COLLECTORS = []  # computed when scraped, e.g. from the DB, rather than aggregated from the workers' samples
+
+
+def register(collector):
+    COLLECTORS.append(collector)
+    REGISTRY.register(collector)
+
+
+def operation() -> str:
+    """Name of the connexion operation handling the current request, e.g. app_routes_post_route."""
+    return request.endpoint.rsplit('.', 1)[-1] if request.endpoint else 'unknown'
+
+
+@contextmanager
+def upstream(engine: str, method: str):
+    """Time a call to an upstream service; set `status` on the yielded dict from the response."""
+    call = {'status': 'ok'}
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        response = getattr(e, 'response', None)
+        call['status'] = getattr(response, 'status_code', None) or getattr(e, 'status', None) or type(e).__name__
+        raise
+    finally:
+        UPSTREAM_DURATION.labels(engine, method, str(call['status'])).observe(time.perf_counter() - start)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_statement(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['statement_start'].pop()
+    if has_request_context():  # i.e. not e.g. a CLI command
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        SQL_DURATION.labels(operation()).observe(duration)
+
+
+@app.before_request
+def start_request():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def end_request(response):
+    if 'request_start' in g and request.endpoint != 'metrics':
+        REQUEST_DURATION.labels(operation(), request.method, response.status_code).observe(
+            time.perf_counter() - g.request_start
+        )
+        SQL_STATEMENTS.labels(operation()).observe(g.get('sql_statements', 0))
+        for bind in [None, *app.config['SQLALCHEMY_BINDS']]:
+            pool = db.get_engine(app, bind=bind).pool
+            for state, value in (('size', pool.size()), ('checked_out', pool.checkedout()), ('overflow', pool.overflow())):
+                DB_POOL.labels(bind or 'primary', state).set(value)
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        for collector in COLLECTORS:
+            registry.register(collector)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
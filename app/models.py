@@ -7,19 +7,26 @@ from app import db
 
 
 class Route(db.Model):
-    """"""
+    """Partitioned by month of `created_at`, which is why it's part of the table's keys."""
     id = db.Column(UUID(as_uuid=True), primary_key=True)
     user_id = db.Column(UUID(as_uuid=True), nullable=False)
-    trip_id = db.Column(UUID(as_uuid=True), unique=True)
+    trip_id = db.Column(UUID(as_uuid=True))
     profile = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, primary_key=True, default=datetime.utcnow)
     distance = db.Column(db.Float)
     duration = db.Column(db.Float)
-    geom = db.Column(Geometry('LineString', srid=32637, spatial_index=False))
-    geom_remainder = db.Column(Geometry('LineString', srid=32637, spatial_index=False))
+    # Geometries can be large, so they're only loaded when asked for, e.g. via `undefer`
+    geom = db.deferred(db.Column(Geometry('LineString', srid=32637, spatial_index=False)))
+    geom_remainder = db.deferred(db.Column(Geometry('LineString', srid=32637, spatial_index=False)))
     is_handled = db.Column(db.Boolean, nullable=False, default=False)
-    pickup_point = db.relationship('PickupPoint', backref='route', uselist=False, lazy=True)
-    dropoff_point = db.relationship('DropoffPoint', backref='route', uselist=False, lazy=True)
+    # Kept by Postgres itself so that history lookups can use an index rather than computing these per row
+    geom_start = db.deferred(db.Column(Geometry('Point', srid=32637, spatial_index=False), db.Computed('ST_StartPoint(geom)')))
+    geom_finish = db.deferred(db.Column(Geometry('Point', srid=32637, spatial_index=False), db.Computed('ST_EndPoint(geom)')))
+    pickup_point = db.relationship('PickupPoint', backref='route', uselist=False, lazy=True, passive_deletes=True)
+    dropoff_point = db.relationship('DropoffPoint', backref='route', uselist=False, lazy=True, passive_deletes=True)
+    __table_args__ = (db.UniqueConstraint('trip_id', 'created_at'),)
+    # Route ids are unique on their own, so keep looking routes up by id only
+    __mapper_args__ = {'primary_key': [id]}
 
     def __repr__(self):
         return f'<Route {self.user_id}>'
@@ -28,9 +35,19 @@ class Route(db.Model):
 class PickupPoint(db.Model):
     """"""
     id = db.Column(UUID(as_uuid=True), primary_key=True)
-    route_id = db.Column(UUID(as_uuid=True), db.ForeignKey('route.id', ondelete='CASCADE'), nullable=False, unique=True)
+    route_id = db.Column(UUID(as_uuid=True), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     geom = db.Column(Geometry('Point', srid=32637, spatial_index=False), nullable=False)
+    # Partition key, follows the route's one so that points get archived along w/ their route
+    route_created_at = db.Column(db.DateTime, primary_key=True)
+    __table_args__ = (
+        db.ForeignKeyConstraint(
+            ['route_id', 'route_created_at'], ['route.id', 'route.created_at'],
+            name='pickup_point_route_fkey', ondelete='CASCADE'
+        ),
+        db.UniqueConstraint('route_id', 'route_created_at'),
+    )
+    __mapper_args__ = {'primary_key': [id]}
 
     def __repr__(self):
         return f'<Pickup point {self.id}>'
@@ -39,14 +56,68 @@ class PickupPoint(db.Model):
 class DropoffPoint(db.Model):
     """"""
     id = db.Column(UUID(as_uuid=True), primary_key=True)
-    route_id = db.Column(UUID(as_uuid=True), db.ForeignKey('route.id', ondelete='CASCADE'), nullable=False, unique=True)
+    route_id = db.Column(UUID(as_uuid=True), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     geom = db.Column(Geometry('Point', srid=32637, spatial_index=False), nullable=False)
+    # Partition key, follows the route's one so that points get archived along w/ their route
+    route_created_at = db.Column(db.DateTime, primary_key=True)
+    __table_args__ = (
+        db.ForeignKeyConstraint(
+            ['route_id', 'route_created_at'], ['route.id', 'route.created_at'],
+            name='dropoff_point_route_fkey', ondelete='CASCADE'
+        ),
+        db.UniqueConstraint('route_id', 'route_created_at'),
+    )
+    __mapper_args__ = {'primary_key': [id]}
 
     def __repr__(self):
         return f'<Dropoff point {self.id}>'
 
 
+class Corridor(db.Model):
+    """A user's driven routes that share start & finish cells, represented by the latest of them."""
+    id = db.Column(UUID(as_uuid=True), primary_key=True)
+    user_id = db.Column(UUID(as_uuid=True), nullable=False)
+    profile = db.Column(db.Text, nullable=False)
+    start_cell = db.Column(db.Text, nullable=False)
+    finish_cell = db.Column(db.Text, nullable=False)
+    route_id = db.Column(UUID(as_uuid=True), nullable=False)  # no FK, the route may get archived
+    trip_count = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    distance = db.Column(db.Float)
+    duration = db.Column(db.Float)
+    geom = db.Column(Geometry('LineString', srid=32637, spatial_index=False), nullable=False)
+    __table_args__ = (db.UniqueConstraint('user_id', 'profile', 'start_cell', 'finish_cell'),)
+
+    def __repr__(self):
+        return f'<Corridor {self.user_id} {self.start_cell}-{self.finish_cell}>'
+
+
+class GeofenceEvent(db.Model):
+    """A driver entering or leaving a passenger's pick-up or drop-off fence, see app.geofences."""
+    id = db.Column(UUID(as_uuid=True), primary_key=True)
+    route_id = db.Column(UUID(as_uuid=True), nullable=False)  # the passenger's; no FK, the route may get archived
+    fence = db.Column(db.Text, nullable=False)  # pickup or dropoff
+    driver_route_id = db.Column(UUID(as_uuid=True), nullable=False)
+    event = db.Column(db.Text, nullable=False)  # enter or exit
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<GeofenceEvent {self.driver_route_id} {self.event} {self.fence} of {self.route_id}>'
+
+
+class UpstreamQuota(db.Model):
+    """An upstream endpoint's calls made on a day & its token bucket, shared by all workers, see app.quota."""
+    endpoint = db.Column(db.Text, primary_key=True)  # e.g. rumap_routing
+    day = db.Column(db.Date, primary_key=True)  # UTC
+    used = db.Column(db.Integer, nullable=False)
+    tokens = db.Column(db.Float, nullable=False)
+    refilled_at = db.Column(db.Float, nullable=False)  # Unix time
+
+    def __repr__(self):
+        return f'<UpstreamQuota {self.endpoint} {self.day}: {self.used}>'
+
+
 class PublicTransportStop(db.Model):
     """"""
     id = db.Column(UUID(as_uuid=True), primary_key=True)
@@ -81,8 +152,22 @@ class Road(db.Model):
 # Create spatial indexes explicitly since alembic dropoff those implied by GeoAlchemy
 db.Index('idx_route_geom', Route.geom, postgresql_using='gist')
 db.Index('idx_route_geom_remainder', Route.geom_remainder, postgresql_using='gist')
+# Cover the user's history lookup in post_route; mixing a uuid into GiST takes the btree_gist extension
+db.Index(
+    'idx_route_history_start', Route.user_id, Route.geom_start, postgresql_using='gist',
+    postgresql_where=Route.is_handled & Route.trip_id.isnot(None)
+)
+db.Index(
+    'idx_route_history_finish', Route.user_id, Route.geom_finish, postgresql_using='gist',
+    postgresql_where=Route.is_handled & Route.trip_id.isnot(None)
+)
 db.Index('idx_pickup_point_geom', PickupPoint.geom, postgresql_using='gist')
 db.Index('idx_dropoff_point_geom', DropoffPoint.geom, postgresql_using='gist')
 db.Index('idx_public_transport_stop_geom', PublicTransportStop.geom, postgresql_using='gist')
 db.Index('idx_aoi_geom', Aoi.geom, postgresql_using='gist')
 db.Index('idx_road_geom', Road.geom, postgresql_using='gist')
+# Latest event of each driver & fence, to tell which fences the drivers are in
+db.Index(
+    'idx_geofence_event_driver', GeofenceEvent.driver_route_id, GeofenceEvent.route_id, GeofenceEvent.fence,
+    GeofenceEvent.created_at
+)
@@ -1,11 +1,11 @@
 import os
 from typing import Iterable
 
-import requests
 import openrouteservice as ors
 from flask import abort
 
-from . import app
+from . import app, metrics, deadline
+from .singleflight import coalesced
 
 
 # Connection constants
@@ -16,6 +16,27 @@ PELIAS_API_KEY = os.getenv('PELIAS_API_KEY', '')
 SUPPORTED_REGIONS = 'Moscow City', 'Moscow Oblast', 'Irkutsk', 'Mari El'
 
 
+class DeadlineClient(ors.Client):
+    """Times each attempt out, incl. the client's own retries, by the time left for the request's upstream calls."""
+    def request(self, url, get_params=None, first_request_time=None, retry_counter=0, requests_kwargs=None, *args,
+                **kwargs):
+        if retry_counter > app.config['UPSTREAM_RETRIES']:
+            raise ors.exceptions.ApiError(503, 'ORS is unavailable')
+        # The client backs off for up to 1.5 ** retry_counter seconds before retrying, within this call
+        backoff = 1.5 ** retry_counter if retry_counter else 0
+        if retry_counter and deadline.left() - backoff < app.config['UPSTREAM_CONNECT_TIMEOUT']:
+            deadline.expired()
+        connect, read = deadline.timeout()
+        requests_kwargs = dict(requests_kwargs or {}, timeout=(connect, read - backoff))
+        return super().request(url, get_params, first_request_time, retry_counter, requests_kwargs, *args, **kwargs)
+
+
+def client_within_deadline() -> ors.Client:
+    """A client timing out, & retrying, only within the time left for the request's upstream calls."""
+    return DeadlineClient(base_url=ORS_ENDPOINT, key=ORS_API_KEY, retry_timeout=deadline.left())
+
+
+@coalesced('ors')
 def directions(
     positions: list[list[float]],
     profile: str,
@@ -23,7 +44,7 @@ def directions(
     geometry: bool = True
 ) -> list[dict]:
     """"""
-    client = ors.Client(base_url=ORS_ENDPOINT, key=ORS_API_KEY)
+    client = client_within_deadline()
     args = {
         'profile': profile,
         'instructions': False,
@@ -36,7 +57,10 @@ def directions(
         } if alternatives else False
     }
     try:
-        res = client.directions(positions, **args)
+        with metrics.upstream('ors', 'directions'):
+            res = client.directions(positions, **args)
+    except ors.exceptions.Timeout:
+        deadline.expired()
     except Exception as e:
         abort(500, str(e))
     try:
@@ -54,6 +78,26 @@ def directions(
     return routes or abort(500, 'ORS failed to route between the requested locations')
 
 
+def matrix(sources: list[list[float]], destinations: list[list[float]], profile: str) -> list[list[float]]:
+    """Travel durations in seconds from each source to each destination, None if unreachable."""
+    client = client_within_deadline()
+    try:
+        with metrics.upstream('ors', 'matrix'):
+            res = client.distance_matrix(
+                sources + destinations,
+                profile=profile,
+                sources=list(range(len(sources))),
+                destinations=list(range(len(sources), len(sources) + len(destinations))),
+                metrics=['duration']
+            )
+    except ors.exceptions.Timeout:
+        deadline.expired()
+    except Exception as e:
+        abort(500, str(e))
+    return res['durations']
+
+
+@coalesced('ors')
 def geocode(text, focus, count=1):
     """"""
     focus_lat, focus_lon = focus
@@ -68,7 +112,9 @@ def geocode(text, focus, count=1):
         'lang': 'ru',
         'api_key': PELIAS_API_KEY
     }
-    res = requests.get(PELIAS_ENDPOINT + '/search', params=params)
+    with metrics.upstream('pelias', 'search') as call:
+        res = deadline.send('GET', PELIAS_ENDPOINT + '/search', params=params)
+        call['status'] = res.status_code
     res.raise_for_status()
     feature = res.json()['features'][0]
     feature['id'] = 1
@@ -79,6 +125,7 @@ def geocode(text, focus, count=1):
     return feature
 
 
+@coalesced('ors')
 def suggest(text, focus):
     """"""
     focus_lat, focus_lon = focus
@@ -91,7 +138,9 @@ def suggest(text, focus):
         'boundary.country': 'RU',
         'api_key': PELIAS_API_KEY
     }
-    res = requests.get(PELIAS_ENDPOINT + '/autocomplete', params=params)
+    with metrics.upstream('pelias', 'autocomplete') as call:
+        res = deadline.send('GET', PELIAS_ENDPOINT + '/autocomplete', params=params)
+        call['status'] = res.status_code
     res.raise_for_status()
     results = filter(
         lambda i: i['properties']['region'] in SUPPORTED_REGIONS,
@@ -106,6 +155,7 @@ def suggest(text, focus):
         }
     } for feature in results]
 
+@coalesced('ors')
 def reverse_geocode(location: Iterable, focus: Iterable):
     """"""
     params = {
@@ -120,7 +170,9 @@ def reverse_geocode(location: Iterable, focus: Iterable):
         'lang': 'ru',
         'api_key': PELIAS_API_KEY
     }
-    res = requests.get(PELIAS_ENDPOINT + '/reverse', params=params)
+    with metrics.upstream('pelias', 'reverse') as call:
+        res = deadline.send('GET', PELIAS_ENDPOINT + '/reverse', params=params)
+        call['status'] = res.status_code
     res.raise_for_status()
     feature = res.json()['features'][0]
     feature['id'] = int(feature['properties']['id'].split('/')[1])
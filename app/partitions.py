@@ -0,0 +1,117 @@
+from datetime import date, datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+
+from app import app, db
+from app.models import Route, PickupPoint, DropoffPoint
+
+
+# Parents come first: points reference routes, so they are created after & detached before them
+PARTITIONED_TABLES = {'route': Route, 'pickup_point': PickupPoint, 'dropoff_point': DropoffPoint}
+# Driven routes are what post_route reuses as prepared routes, so they must outlive their partition
+RETAINED_ROUTES = 'trip_id IS NOT NULL AND is_handled'
+
+cli = AppGroup('routes', help='Manage the time-partitioned route storage.')
+
+
+def month_start(day: date, months: int = 0) -> date:
+    """First day of the month `months` away from `day`'s month."""
+    year, month = divmod(day.year * 12 + day.month - 1 + months, 12)
+    return date(year, month + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f'{table}_p{month:%Y_%m}'
+
+
+def stored_columns(table: str) -> str:
+    """Columns that can be copied, i.e. all but those computed by Postgres."""
+    columns = PARTITIONED_TABLES[table].__table__.columns
+    return ', '.join(column.name for column in columns if column.computed is None)
+
+
+def create_partitions(month: date):
+    """Create a monthly partition of every partitioned table, unless it already exists."""
+    for table in PARTITIONED_TABLES:
+        db.session.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} '
+            f"FOR VALUES FROM ('{month}') TO ('{month_start(month, 1)}')"
+        ))
+
+
+def list_partitions(table: str = 'route') -> list[date]:
+    """Months that currently have an attached partition of `table`."""
+    rows = db.session.execute(text(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+        'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE parent.relname = :table'
+    ), {'table': table})
+    prefix = f'{table}_p'
+    return sorted(
+        datetime.strptime(name[len(prefix):], '%Y_%m').date()
+        for name, in rows if name.startswith(prefix)
+    )
+
+
+def archive_partition(month: date, schema: str = None):
+    """Detach the month's partitions, keeping the driven routes in the default partition.
+
+    The detached tables are moved to `schema`, or dropped if no schema is given.
+    """
+    for table in reversed(list(PARTITIONED_TABLES)):
+        db.session.execute(text(f'ALTER TABLE {table} DETACH PARTITION {partition_name(table, month)}'))
+        if table != 'route':  # a detached table keeps its foreign key, which would block detaching the routes
+            db.session.execute(text(
+                f'ALTER TABLE {partition_name(table, month)} DROP CONSTRAINT IF EXISTS {table}_route_fkey'
+            ))
+    # Once detached, the month is not covered by any partition, so re-inserted rows land in the default one
+    columns = stored_columns('route')
+    db.session.execute(text(
+        f'INSERT INTO route ({columns}) '
+        f'SELECT {columns} FROM {partition_name("route", month)} WHERE {RETAINED_ROUTES}'
+    ))
+    for table in ('pickup_point', 'dropoff_point'):
+        columns = stored_columns(table)
+        db.session.execute(text(
+            f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {partition_name(table, month)} '
+            f'WHERE route_id IN (SELECT id FROM {partition_name("route", month)} WHERE {RETAINED_ROUTES})'
+        ))
+    for table in PARTITIONED_TABLES:
+        if schema:
+            db.session.execute(text(f'ALTER TABLE {partition_name(table, month)} SET SCHEMA {schema}'))
+        else:
+            db.session.execute(text(f'DROP TABLE {partition_name(table, month)}'))
+
+
+@cli.command('partition')
+@click.option('--ahead', type=int, help='Number of future months to create partitions for.')
+def partition_command(ahead):
+    """Make sure partitions exist for the current and the upcoming months."""
+    ahead = app.config['ROUTE_PARTITIONS_AHEAD'] if ahead is None else ahead
+    this_month = month_start(date.today())
+    for months in range(ahead + 1):
+        create_partitions(month_start(this_month, months))
+    db.session.commit()
+
+
+@cli.command('archive')
+@click.option('--days', type=int, help='Archive partitions whose routes are all older than this.')
+def archive_command(days):
+    """Detach partitions past the retention age and archive or drop them."""
+    days = app.config['ROUTE_RETENTION_DAYS'] if days is None else days
+    cutoff = date.today() - timedelta(days=days)
+    schema = app.config['ROUTE_ARCHIVE_SCHEMA']
+    if schema:
+        db.session.execute(text(f'CREATE SCHEMA IF NOT EXISTS {schema}'))
+    for month in list_partitions():
+        if month_start(month, 1) <= cutoff:
+            archive_partition(month, schema)
+            db.session.commit()  # one transaction per month to keep locks short
+            click.echo(f'Archived {partition_name("route", month)}')
+    db.session.commit()
+
+
+app.cli.add_command(cli)
@@ -0,0 +1,67 @@
+import os
+import glob
+import random
+import cProfile
+import threading
+from datetime import datetime
+
+from flask import g, request
+
+from app import app, metrics
+
+
+# cProfile hooks the whole thread, i.e. all of a gevent worker's greenlets, & a second profiler would replace
+# the first; so only one request is profiled at a time, & its profile may include others' concurrent work
+_active = threading.Lock()
+
+
+def is_requested() -> bool:
+    """Profile if asked to by an authorized client, or if the request is sampled."""
+    token = app.config['PROFILING_TOKEN']
+    if token and request.headers.get('X-Profile') == token:
+        return True
+    rate = app.config['PROFILING_SAMPLE_RATE']
+    return bool(rate) and random.randrange(rate) == 0
+
+
+def start_profiling():
+    if not is_requested():
+        return
+    if not _active.acquire(blocking=False):
+        app.logger.info(f'Not profiling {request.path}, another request is being profiled')
+        return
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+
+def disable():
+    """Stop the request's profiler, if it has one, & let the next request be profiled; returns the profiler."""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _active.release()
+    return profiler
+
+
+def stop_profiling(response):
+    profiler = disable()
+    if profiler is None:
+        return response
+    directory = app.config['PROFILING_DIR']
+    os.makedirs(directory, exist_ok=True)
+    tags = [f'{datetime.utcnow():%Y%m%dT%H%M%S%f}', metrics.operation()]
+    if (request.view_args or {}).get('route_id'):
+        tags.append(str(request.view_args['route_id']))
+    # pstats dumps can be opened as flame graphs by e.g. speedscope, snakeviz or flameprof
+    profiler.dump_stats(os.path.join(directory, '_'.join(tags) + '.prof'))
+    # Keep only the latest profiles
+    for path in sorted(glob.glob(os.path.join(directory, '*.prof')))[:-app.config['PROFILING_MAX_FILES']]:
+        os.remove(path)
+    return response
+
+
+# Hooks are only installed if profiling is on, so that it costs nothing otherwise
+if app.config['PROFILING_ENABLED']:
+    app.before_request(start_profiling)
+    app.after_request(stop_profiling)
+    app.teardown_request(lambda exc: disable())  # e.g. if the request failed before its after_request hooks
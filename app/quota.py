@@ -0,0 +1,102 @@
+"""Rate limits & daily quotas of upstream endpoints, shared by all the workers via the DB.
+
+Each endpoint has a token bucket, refilled at `rate` calls per second up to `burst` of them, & a
+number of calls per (UTC) day. Calls are only made if both allow them; that's checked & counted in a
+single upsert, committed on its own so that the row isn't kept locked for the rest of the request.
+Workers reserve calls in batches, see `spend`, so that most calls don't touch the DB at all.
+"""
+import time
+import threading
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from prometheus_client.core import GaugeMetricFamily
+
+from app import db
+from app.models import UpstreamQuota
+
+
+_reserved = {}  # endpoint -> (day, calls this worker has taken from the DB & not made yet)
+_lock = threading.Lock()
+
+
+def acquire(endpoint: str, rate: float, burst: int, daily: int, calls: int = 1) -> bool:
+    """Take the calls from the endpoint's bucket & today's quota, if there are as many left in both."""
+    if calls > daily or calls > burst:
+        return False
+    table = UpstreamQuota.__table__
+    now = func.extract('epoch', func.clock_timestamp())
+    tokens = func.least(burst, table.c.tokens + (now - table.c.refilled_at) * rate)
+    statement = insert(table).values(
+        endpoint=endpoint, day=datetime.utcnow().date(), used=calls, tokens=burst - calls, refilled_at=now
+    ).on_conflict_do_update(
+        index_elements=['endpoint', 'day'],
+        set_={'used': table.c.used + calls, 'tokens': tokens - calls, 'refilled_at': now},
+        where=(table.c.used + calls <= daily) & (tokens >= calls)
+    ).returning(table.c.used)
+    with db.engine.begin() as connection:
+        return connection.execute(statement).scalar() is not None
+
+
+def spend(endpoint: str, rate: float, burst: int, daily: int, batch: int) -> bool:
+    """Make a call out of this worker's reserve, reserving up to `batch` calls once it's used up.
+
+    Calls reserved but not made by the end of the day are lost to the quota, i.e. up to a batch
+    per worker.
+    """
+    if daily <= 0:
+        return False
+    today = datetime.utcnow().date()
+    with _lock:
+        day, reserved = _reserved.get(endpoint, (today, 0))
+        if day == today and reserved:
+            _reserved[endpoint] = day, reserved - 1
+            return True
+    # A whole batch, else one call at a time, e.g. while the last ones of the day are left
+    for calls in sorted({max(min(batch, burst, daily), 1), 1}, reverse=True):
+        if acquire(endpoint, rate, burst, daily, calls):
+            with _lock:
+                day, reserved = _reserved.get(endpoint, (today, 0))
+                _reserved[endpoint] = today, (reserved if day == today else 0) + calls - 1
+            return True
+    return False
+
+
+def exhaust(endpoint: str, daily: int):
+    """Mark today's quota as used up, e.g. once the upstream says so before it's been counted as such."""
+    with _lock:
+        _reserved.pop(endpoint, None)
+    table = UpstreamQuota.__table__
+    statement = insert(table).values(
+        endpoint=endpoint, day=datetime.utcnow().date(), used=daily, tokens=0, refilled_at=time.time()
+    ).on_conflict_do_update(
+        index_elements=['endpoint', 'day'], set_={'used': func.greatest(table.c.used, daily)}
+    )
+    with db.engine.begin() as connection:
+        connection.execute(statement)
+
+
+def remaining(quotas: dict) -> dict:
+    """Calls left today, by endpoint, given their daily quotas; those reserved by workers count as made."""
+    used = dict(db.session.query(UpstreamQuota.endpoint, UpstreamQuota.used).filter(
+        UpstreamQuota.endpoint.in_(quotas), UpstreamQuota.day == datetime.utcnow().date()
+    ))
+    return {endpoint: max(daily - used.get(endpoint, 0), 0) for endpoint, daily in quotas.items()}
+
+
+class RemainingCollector:
+    """Reports the calls left today when metrics are scraped, as counted by all the workers."""
+    def __init__(self, quotas):
+        self.quotas = quotas  # a function returning the daily quotas by endpoint
+
+    def describe(self):
+        yield GaugeMetricFamily('geo_upstream_quota_remaining', '', labels=['endpoint'])
+
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            'geo_upstream_quota_remaining', 'Calls to upstream endpoints left for today', labels=['endpoint']
+        )
+        for endpoint, calls in remaining(self.quotas()).items():
+            gauge.add_metric([endpoint], calls)
+        yield gauge
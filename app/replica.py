@@ -0,0 +1,85 @@
+from functools import wraps
+
+from flask import current_app, g, request, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, text
+from sqlalchemy.exc import DBAPIError
+
+
+REPLICA = 'replica'  # bind key, see Config.SQLALCHEMY_BINDS
+# The primary's WAL position after a client's writes; clients send it back, as the cookie or the header,
+# for their reads to wait for the replica to catch up w/ it, whichever worker serves them
+LSN_COOKIE = 'replica_min_lsn'
+LSN_HEADER = 'X-Replica-Min-LSN'
+
+
+class RoutingSession(SignallingSession):
+    """Sends the queries of read-only requests to the replica, everything else to the primary."""
+    def get_bind(self, mapper=None, clause=None):
+        if in_use() and not self._flushing:
+            return self.db.get_engine(self.app, bind=REPLICA)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        super().init_app(app)
+        app.after_request(pass_written_lsn)
+
+
+def configured() -> bool:
+    return REPLICA in (current_app.config['SQLALCHEMY_BINDS'] or {})
+
+
+def in_use() -> bool:
+    return has_request_context() and g.get('use_replica', False)
+
+
+def use_primary():
+    """Make the rest of the request read from the primary, e.g. when the replica is behind."""
+    g.use_replica = False
+
+
+def mark_written():
+    """Have the client read from the primary until the replica has replayed this request's writes."""
+    g.written = True
+
+
+def pass_written_lsn(response):
+    """Hand the client the primary's WAL position once the request has committed its writes."""
+    if g.get('written') and configured() and response.status_code < 400:
+        engine = current_app.extensions['sqlalchemy'].db.get_engine(current_app)
+        lsn = engine.execute(text('SELECT pg_current_wal_lsn()::text')).scalar()
+        response.headers[LSN_HEADER] = lsn
+        response.set_cookie(
+            LSN_COOKIE, lsn, max_age=current_app.config['REPLICA_STICKY_SECONDS'], httponly=True, samesite='Lax'
+        )
+    return response
+
+
+def replica_caught_up(lsn: str) -> bool:
+    """Whether the replica has replayed the primary's WAL up to the position."""
+    engine = current_app.extensions['sqlalchemy'].db.get_engine(current_app, bind=REPLICA)
+    try:
+        return bool(engine.execute(
+            text('SELECT pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn)'), lsn=lsn
+        ).scalar())
+    except DBAPIError:  # e.g. a malformed position
+        return False
+
+
+def read_only(handler):
+    """Route the handler's queries to the read replica, if one is configured.
+
+    Clients that have written within the last REPLICA_STICKY_SECONDS & send back the WAL position they
+    were given read from the primary, until the replica has caught up w/ it.
+    """
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        lsn = request.headers.get(LSN_HEADER) or request.cookies.get(LSN_COOKIE)
+        g.use_replica = configured() and (not lsn or replica_caught_up(lsn))
+        return handler(*args, **kwargs)
+    return wrapper
@@ -1,17 +1,27 @@
+import queue
 from uuid import uuid4
-from requests.models import HTTPError
+from concurrent.futures import ThreadPoolExecutor
+from requests import RequestException
 
 import sqlalchemy
-from sqlalchemy import func
-from shapely.geometry import Point, LineString
+from sqlalchemy import func, select, cast, bindparam
+from sqlalchemy.orm import undefer
+from sqlalchemy.dialects.postgresql import insert
+from shapely.geometry import Point, LineString, mapping
 from shapely.ops import nearest_points, substring, snap, linemerge, unary_union
 from geojson import Feature, FeatureCollection
-from flask import request, abort
+from flask import request, abort, Response, stream_with_context
+from werkzeug.exceptions import HTTPException
 from geoalchemy2.shape import from_shape, to_shape
 
-from app import app, db, ors, rumap
+from app import (
+    app, db, ors, rumap, local, corridors, replica, events, geofences, serialization, deadline, stops as stop_index
+)
 from app.models import DropoffPoint, Route, PickupPoint, PublicTransportStop, Aoi, Road
-from app.helpers import project, to_wgs84, haversine, route_to_feature, parse_lat_lon
+from app.helpers import (
+    project, to_wgs84, haversine, route_to_feature, route_schema, parse_lat_lon, insert_routes
+)
+from app.replica import read_only
 
 
 PROJECTION = app.config['PROJECTION']  # to save some typing and avoid typos
@@ -36,6 +46,7 @@ def healthcheck():
     return response
 
 
+@read_only
 def get_roads(position, radius):
     position = project(Point(parse_lat_lon(position)))
     roads = Road.query.filter(func.ST_DWithin(Road.geom, from_shape(position, PROJECTION), radius))
@@ -48,8 +59,10 @@ def get_roads(position, radius):
     ])
 
 
+@read_only
 def get_areas():
-    areas = Aoi.query.all()
+    # In a set order, for the body & its ETag to be the same in each worker
+    areas = Aoi.query.order_by(Aoi.id).all()
     return {
         'polygons': FeatureCollection([
             Feature(area.id, to_wgs84(to_shape(area.geom)), {'name': area.name}) for area in areas
@@ -60,6 +73,7 @@ def get_areas():
     }
 
 
+@read_only
 def get_stops(bbox):
     if bbox:
         # Parse the coords
@@ -67,143 +81,285 @@ def get_stops(bbox):
         # Project the coords
         min_lon, min_lat = project(Point(min_lon, min_lat)).coords[0]
         max_lon, max_lat = project(Point(max_lon, max_lat)).coords[0]
-        # Query
-        bbox = func.ST_MakeEnvelope(min_lon, min_lat, max_lon, max_lat, PROJECTION)
-        stops = PublicTransportStop.query.filter(func.ST_Intersects(PublicTransportStop.geom, bbox))
+        # Query the in-memory index rather than the DB
+        index = stop_index.get()
+        return FeatureCollection([
+            Feature(index.ids[i], Point(index.wgs84[i]), {'name': index.names[i]})
+            for i in index.in_bbox(min_lon, min_lat, max_lon, max_lat)
+        ])
     else:
-        stops = PublicTransportStop.query.all()
+        stops = PublicTransportStop.query.order_by(PublicTransportStop.id).all()
     return FeatureCollection([
         Feature(stop.id, to_wgs84(to_shape(stop.geom)), {'name': stop.name})
         for stop in stops
     ])
 
 
+def leg_engine():
+    """Engine for short legs, which are routed by ORS unless they can be served locally."""
+    return local if app.config['GEO_ENGINE'] == 'local' else ors
+
+
+def directions(positions: list, profile: str, alternatives: bool = False) -> list[dict]:
+    """Route via the configured engine, or via ORS if rumap fails, incl. connection errors, or is out of quota."""
+    if app.config['GEO_ENGINE'] == 'rumap':
+        try:
+            return rumap.directions(positions, profile, alternatives)
+        except (RequestException, rumap.QuotaExceeded):
+            pass
+        return ors.directions(positions, profile, alternatives)
+    return globals()[app.config['GEO_ENGINE']].directions(positions, profile, alternatives)
+
+
+def get_route_or_404(route_id, *geometries):
+    """Get a route; its geometries are deferred, so only the listed ones get loaded along w/ it."""
+    query = Route.query.options(*map(undefer, geometries))
+    route = query.get(route_id)
+    if route is None and replica.in_use():  # may have been just created by another worker
+        replica.use_primary()
+        route = query.get(route_id)
+    return route or abort(404, ROUTE_NOT_FOUND_MESSAGE)
+
+
+def get_route_point(model, route_id, name):
+    """Fetch a route's pick-up or drop-off point in a single query, w/out loading the route itself."""
+    row = db.session.query(Route.id, model.geom).outerjoin(
+        model, (model.route_id == Route.id) & (model.route_created_at == Route.created_at)
+    ).filter(Route.id == route_id).first()
+    if row is None:
+        abort(404, ROUTE_NOT_FOUND_MESSAGE)
+    if row.geom is None:
+        return (f'Route {route_id} has no {name} point', 204)
+    return list(to_wgs84(to_shape(row.geom)).coords[0])
+
+
+def save_route_point(model, route_id, name):
+    """Insert or move a passenger's pick-up or drop-off point in a single statement."""
+    table = model.__table__
+    geom = from_shape(project(Point(request.json['position'][::-1])), srid=PROJECTION, extended=True)
+    point = insert(table).from_select(
+        ['id', 'route_id', 'route_created_at', 'geom'],
+        select([
+            cast(bindparam('id', uuid4(), type_=table.c.id.type), table.c.id.type),
+            Route.id,
+            Route.created_at,
+            cast(bindparam('geom', geom, type_=table.c.geom.type), table.c.geom.type)
+        ]).where((Route.id == route_id) & (Route.profile != 'driving-car'))
+    )
+    point_id = db.session.execute(point.on_conflict_do_update(
+        index_elements=['route_id', 'route_created_at'],
+        set_={'geom': point.excluded.geom}
+    ).returning(table.c.id)).scalar()
+    if point_id is None:  # nothing to insert, find out why
+        if db.session.query(Route.profile).filter(Route.id == route_id).scalar() is None:
+            abort(404, ROUTE_NOT_FOUND_MESSAGE)
+        abort(400, f'Only passenger routes can have {name} points')
+    events.publish(route_id, table.name)
+    db.session.commit()
+    replica.mark_written()
+    geofences.point_changed(route_id, table.name)
+    return point_id, 201
+
+
 def get_route_start_or_finish(route_id, point):
     index = 0 if point == 'start' else -1
-    route = to_shape(Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE).geom)
+    route = to_shape(get_route_or_404(route_id, Route.geom).geom)
     endpoint_wgs84 = to_wgs84(Point(route.coords[index]))
     return list(endpoint_wgs84.coords[0])  # returning a tuple, as provided by Shapely, raises an error
 
 
+def is_driver_at_dropoff(route_id, driver_position: Point, passenger_route=None) -> bool:
+    """Whether the driver is in the passenger's drop-off fence, or near their route if there's no drop-off point."""
+    arrived = geofences.contains(route_id, 'dropoff', driver_position.x, driver_position.y)
+    if arrived is None:
+        if passenger_route is None:
+            passenger_route = to_shape(get_route_or_404(route_id, Route.geom).geom)
+        arrived = driver_position.distance(passenger_route) < app.config['DROPOFF_RADIUS']
+    return arrived
+
+
 def is_passenger_arrived(route_id, position):
-    route = to_shape(Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE).geom)
-    driver_position = project(Point(parse_lat_lon(position)))
-    return driver_position.distance(route) < app.config['DROPOFF_RADIUS']
+    get_route_or_404(route_id)
+    return is_driver_at_dropoff(route_id, project(Point(parse_lat_lon(position))))
 
 
 def get_pickup_point(route_id):
-    point = Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE).pickup_point
-    if point:
-        return list(to_wgs84(to_shape(point.geom)).coords[0])
-    return (f'Route {route_id} has no pick-up point', 204)
+    return get_route_point(PickupPoint, route_id, 'pick-up')
 
 
 def delete_pickup_point(route_id):
     point = Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE).pickup_point
     if point:
         db.session.delete(point)
+        events.publish(route_id, 'pickup_point')
         db.session.commit()
+        replica.mark_written()
+        geofences.point_changed(route_id, 'pickup_point')
     else:
         abort(404, f'Route {route_id} has no pick-up point')
 
 
 def post_pickup_point(route_id):
-    geom = project(Point(request.json['position'][::-1])).wkt
-    route = Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE)
-    if route.profile == 'driving-car':
-        abort(400, 'Only passenger routes can have pick-up points')
-    point = PickupPoint.query.filter(PickupPoint.route_id == route_id).first()
-    if point:
-        point.geom = geom
-    else:
-        point = PickupPoint(id=uuid4(), geom=geom, route_id=route_id)
-        db.session.add(point)
-    db.session.commit()
-    return point.id, 201
+    return save_route_point(PickupPoint, route_id, 'pick-up')
 
 
 def get_dropoff_point(route_id):
-    point = Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE).dropoff_point
-    if point:
-        return list(to_wgs84(to_shape(point.geom)).coords[0])
-    return (f'Route {route_id} has no drop-off point', 204)
+    return get_route_point(DropoffPoint, route_id, 'drop-off')
 
 
 def post_dropoff_point(route_id):
-    geom = project(Point(request.json['position'][::-1])).wkt
-    route = Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE)
-    if route.profile == 'driving-car':
-        abort(400, 'Only passenger routes can have drop-off points')
-    point = DropoffPoint.query.filter(DropoffPoint.route_id == route_id).first()
-    if point:
-        point.geom = geom
-    else:
-        point = DropoffPoint(id=uuid4(), geom=geom, route_id=route_id)
-        db.session.add(point)
-    db.session.commit()
-    return point.id, 201
+    return save_route_point(DropoffPoint, route_id, 'drop-off')
 
 
+@read_only
 def get_remainder(route_id):
-    remainder = Route.query.get_or_404(route_id).geom_remainder
-    return Feature(route_id, to_wgs84(to_shape(remainder)), {'distance': round(remainder.length)})
+    query = db.session.query(Route.geom_remainder).filter(Route.id == route_id)
+    row = query.first()
+    if row is None and replica.in_use():  # may have been just created by another worker
+        replica.use_primary()
+        row = query.first()
+    if row is None:
+        abort(404, ROUTE_NOT_FOUND_MESSAGE)
+    remainder = to_shape(row.geom_remainder)
+    return Feature(route_id, to_wgs84(remainder), {'distance': round(remainder.length)})
 
 
 def post_remainder(route_id):
-    route = Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE)
+    route = get_route_or_404(route_id, Route.geom)
     route_geom = to_shape(route.geom)
     current_position = project(Point(request.json['position'][::-1]))
     current_position_snapped = nearest_points(route_geom, current_position)[0]
     route_passed_fraction = route_geom.project(current_position_snapped, normalized=True)
     remainder = substring(route_geom, route_passed_fraction, 1, normalized=True)
     route.geom_remainder = from_shape(remainder)
+    events.publish(route_id, 'remainder')
+    if route.profile == 'driving-car':
+        geofences.record(route_id, current_position.x, current_position.y)
     db.session.commit()
+    replica.mark_written()
     return Feature(route_id, to_wgs84(remainder), {'distance': round(remainder.length)})
 
 
-def suggest_pickup(route_id, position):
-    driver_route = Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE).geom
+def route_events(route_id, driver_route_id=None):
+    """Stream the route's events as they happen, & the passenger's arrival if the driver's route is given.
+
+    Streams start w/ the current state; they're meant for gevent workers, each open one taking a greenlet.
+    """
+    route = get_route_or_404(route_id, *([Route.geom] if driver_route_id else []))
+    route_ids = [str(route_id)]
+    if driver_route_id:
+        passenger_route = to_shape(route.geom)
+        get_route_or_404(driver_route_id)
+        route_ids.append(str(driver_route_id))
+    # Subscribe before reading the current state, so that no change in between gets lost
+    subscriber = events.subscribe(*route_ids)
+    current = [(str(route_id), event, events.load(route_id, event)) for event in events.EVENTS]
+    if driver_route_id:
+        current.append((str(driver_route_id), 'remainder', events.load(driver_route_id, 'remainder')))
+    db.session.close()  # not to hold a DB connection for as long as the stream is open
+
+    def stream():
+        arrived = None
+        try:
+            while True:
+                if current:
+                    source, event, data = current.pop(0)
+                else:
+                    try:
+                        source, event, data = subscriber.get(timeout=app.config['EVENTS_KEEPALIVE'])
+                    except queue.Empty:
+                        yield b': keepalive\n\n'  # so that proxies don't close an idle stream
+                        continue
+                if source == str(driver_route_id):
+                    if event != 'remainder' or data is None:
+                        continue
+                    # The remainder starts where the driver is
+                    driver_position = project(Point(data['geometry']['coordinates'][0]))
+                    event, data = 'arrived', is_driver_at_dropoff(route_id, driver_position, passenger_route)
+                    db.session.close()  # in case the fences got reloaded
+                    if data == arrived:
+                        continue
+                    arrived = data
+                yield f'event: {event}\ndata: {serialization.dumps(data)}\n\n'.encode()
+        finally:
+            events.unsubscribe(subscriber, *route_ids)
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    response.direct_passthrough = True  # pass chunks as they come rather than collecting the body, e.g. to validate
+    return response
+
+
+@read_only
+def suggest_pickup(route_id, position, rank=False, count=None):
+    driver_route = get_route_or_404(route_id, Route.geom).geom
     driver_route_shape = to_shape(driver_route)
     passenger_start = project(Point(parse_lat_lon(position)))
     # Identify the closest point on the driver's route
     nearest_point = nearest_points(driver_route_shape, passenger_start)[0]
     radius = min(passenger_start.distance(nearest_point), app.config['PICKUP_MAX_RADIUS'])
     radius = max(radius, app.config['PICKUP_MIN_RADIUS'])
-    # Retrieve the relevant public transport stops
-    stops = PublicTransportStop.query.filter(
-        func.ST_DWithin(PublicTransportStop.geom, from_shape(nearest_point, PROJECTION), radius)
-    )
+    # Retrieve the relevant public transport stops, nearest first
+    index = stop_index.get()
+    stops = index.within(nearest_point.x, nearest_point.y, radius)
+    if not rank or not len(stops):
+        return {
+            'radius': radius,
+            'nearest_point': Feature(geometry=to_wgs84(nearest_point)),
+            'stops': FeatureCollection([Feature(geometry=Point(index.wgs84[i])) for i in stops]),
+        }
+    # Rank by the passenger's walk to the stop plus the driver's way off the route & back
+    walking_durations = ors.matrix(
+        [list(to_wgs84(passenger_start).coords[0])],
+        [list(index.wgs84[i]) for i in stops],
+        'foot-walking'
+    )[0]
+    ranked = []
+    for i, walking_duration in zip(stops, walking_durations):
+        if walking_duration is None:  # ORS could not reach the stop
+            continue
+        detour = 2 * driver_route_shape.distance(Point(index.coords[i])) / app.config['PICKUP_DETOUR_SPEED']
+        ranked.append((walking_duration + detour, i, walking_duration, detour))
+    ranked.sort(key=lambda stop: stop[0])
     return {
         'radius': radius,
         'nearest_point': Feature(geometry=to_wgs84(nearest_point)),
-        'stops': FeatureCollection([Feature(geometry=to_wgs84(to_shape(stop.geom))) for stop in stops]),
+        'stops': FeatureCollection([
+            Feature(
+                geometry=Point(index.wgs84[i]),
+                properties={
+                    'duration': round(duration, 1),
+                    'walking_duration': round(walking_duration, 1),
+                    'detour_duration': round(detour, 1)
+                }
+            ) for duration, i, walking_duration, detour in ranked[:count or app.config['PICKUP_MAX_SUGGESTIONS']]
+        ]),
     }
 
 
 def walking_route(route_id):
     """"""
-    route = to_shape(Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE).geom)
+    route = to_shape(get_route_or_404(route_id, Route.geom).geom)
     position = request.json['position'][::-1]  # lat, lon -> lon, lat
     nearest_point = to_wgs84(nearest_points(route, project(Point(position)))[0]).coords[0]
     positions = [position, nearest_point]
     if request.json['to_or_from'] == 'from':
         positions.reverse()
-    route = ors.directions(positions, 'foot-walking')[0]
+    route = leg_engine().directions(positions, 'foot-walking')[0]
     if request.json['to_or_from'] == 'to':
         route['geometry'].append(nearest_point)
     else:
         route['geometry'].insert(0, nearest_point)
     route_id = uuid4()
-    route_geom = project(LineString(route['geometry'])).wkt
-    db.session.add(Route(
-        id=route_id,
-        user_id=request.json['user_id'],
-        profile='foot-walking',
-        geom=route_geom,
-        geom_remainder=route_geom,
-        distance=route['distance'],
-        duration=route['duration']
-    ))
+    insert_routes([{
+        'id': route_id,
+        'user_id': request.json['user_id'],
+        'profile': 'foot-walking',
+        'geom': project(LineString(route['geometry'])),
+        'distance': route['distance'],
+        'duration': route['duration']
+    }])
     db.session.commit()
     return Feature(
         id=route_id,
@@ -230,81 +386,85 @@ def post_route():
     # Order intermediate positions along the route
     if len(positions) > 2:
         positions.sort(key=lambda position: start_projected.distance(project(Point(position))))
+    # Frequently driven routes are kept as corridors, so the user's history is only searched if there are none
+    past_routes = corridors.find(
+        request.json['user_id'], request.json['profile'], start_projected, finish_projected
+    ) if with_alternatives else []
     # Check if there are similar routes in the user's history; if there are any, return them along w/ the new ones
-    if with_alternatives:
+    if with_alternatives and not past_routes:
         # Get all the routes from the user's history
-        past_routes = Route.query.filter(
+        past_routes = Route.query.options(undefer(Route.geom)).filter(
             Route.user_id == request.json['user_id'],  # only same user's routes
             Route.is_handled,  # only those built using handles
             Route.trip_id != None,  # only actually driven routes
-            func.ST_Distance(  # starts aren't further apart than ...
-                func.ST_StartPoint(Route.geom),
-                from_shape(start_projected, PROJECTION)
-            ) < app.config['POINT_PROXIMITY_THRESHOLD'],
-            func.ST_Distance(  # finishes aren't further apart than ...
-                func.ST_EndPoint(Route.geom),
-                from_shape(finish_projected, PROJECTION)
-            ) < app.config['POINT_PROXIMITY_THRESHOLD']
-        ).order_by(Route.created_at.desc()).limit(app.config['MAX_PREPARED_ROUTES'])  # only latest
-        for route in past_routes:
-            # Convert common part bc the other parts will be returned from ORS as dict
-            route = {
-                'geometry': to_shape(route.geom),
-                'distance': route.distance,
-                'duration': route.duration
-            }
-            # Get the closest points on the past route to counterparts requested by the user
-            nearest_to_start, _ = nearest_points(route['geometry'], start_projected)
-            nearest_to_finish, _ = nearest_points(route['geometry'], finish_projected)
-            # Reproject them back to WGS84 for the ORS
-            nearest_to_start_4326 = to_wgs84(nearest_to_start).coords[0]
-            nearest_to_finish_4326 = to_wgs84(nearest_to_finish).coords[0]
-            # Extract the relevant part of the past route
-            cut_point_distances = (route['geometry'].project(pt) for pt in (nearest_to_start, nearest_to_finish))
-            route['geometry'] = substring(route['geometry'], *cut_point_distances)
-            # A tail is from the start to the point closest to the start, a head - likewise but from the finish
-            tail = ors.directions([positions[0], nearest_to_start_4326], request.json['profile'])[0]
-            head = ors.directions([nearest_to_finish_4326, positions[-1]], request.json['profile'])[0]
-            parts_to_merge = [route]  # tail and head will get added if they prove non-empty
-            for part in tail, head:
-                try:
-                    part['geometry'] = project(LineString(part['geometry']).simplify(0))
-                except ValueError:  # part['geometry'] contains < 2 positions
-                    continue
-                # Remove duplicate segments
-                part['geometry'] = LineString([
-                    snap(Point(coords), nearest_points(route['geometry'], Point(coords))[0], 25)
-                    for coords in part['geometry'].coords
-                ])
-                # Remove overlapping parts
-                if part['geometry'].overlaps(route['geometry']) and not part['geometry'].within(route['geometry']):
-                    part['geometry'], route['geometry'] = part['geometry'].symmetric_difference(route['geometry'])
-                    parts_to_merge.append(part)  # is a proper part, add to list for merging
-            # Stitch the parts together if there is a tail or a head, or both
-            if len(parts_to_merge) > 1:
-                full_route = linemerge(unary_union([part['geometry'] for part in parts_to_merge]))
-            else:
-                full_route = route['geometry']
-            prepared_routes.append({
-                'geometry': to_wgs84(full_route).coords,
-                'distance': sum(part['distance'] for part in parts_to_merge),
-                'duration': sum(part['duration'] for part in parts_to_merge)
-            })
-            prepared_route_buffers.append(
-                route['geometry'].buffer(app.config['ROUTE_BUFFER_SIZE'], cap_style=2)
+            func.ST_DWithin(  # starts aren't further apart than ...
+                Route.geom_start,
+                from_shape(start_projected, PROJECTION),
+                app.config['POINT_PROXIMITY_THRESHOLD']
+            ),
+            func.ST_DWithin(  # finishes aren't further apart than ...
+                Route.geom_finish,
+                from_shape(finish_projected, PROJECTION),
+                app.config['POINT_PROXIMITY_THRESHOLD']
             )
+        ).order_by(Route.created_at.desc()).limit(app.config['MAX_PREPARED_ROUTES'])  # only latest
+        # Convert common part bc the other parts will be returned from ORS as dict
+        past_routes = [
+            {'geometry': to_shape(route.geom), 'distance': route.distance, 'duration': route.duration}
+            for route in past_routes
+        ]
+    # Corridors & past routes alike are cut to the requested start & finish, w/ the legs to them added
+    for route in past_routes:
+        # Get the closest points on the past route to counterparts requested by the user
+        nearest_to_start, _ = nearest_points(route['geometry'], start_projected)
+        nearest_to_finish, _ = nearest_points(route['geometry'], finish_projected)
+        # Reproject them back to WGS84 for the ORS
+        nearest_to_start_4326 = to_wgs84(nearest_to_start).coords[0]
+        nearest_to_finish_4326 = to_wgs84(nearest_to_finish).coords[0]
+        # Extract the relevant part of the past route
+        cut_point_distances = (route['geometry'].project(pt) for pt in (nearest_to_start, nearest_to_finish))
+        route['geometry'] = substring(route['geometry'], *cut_point_distances)
+        # A tail is from the start to the point closest to the start, a head - likewise but from the finish
+        tail = leg_engine().directions([positions[0], nearest_to_start_4326], request.json['profile'])[0]
+        head = leg_engine().directions([nearest_to_finish_4326, positions[-1]], request.json['profile'])[0]
+        parts_to_merge = [route]  # tail and head will get added if they prove non-empty
+        for part in tail, head:
+            try:
+                part['geometry'] = project(LineString(part['geometry']).simplify(0))
+            except ValueError:  # part['geometry'] contains < 2 positions
+                continue
+            # Remove duplicate segments
+            part['geometry'] = LineString([
+                snap(Point(coords), nearest_points(route['geometry'], Point(coords))[0], 25)
+                for coords in part['geometry'].coords
+            ])
+            # Remove overlapping parts
+            if part['geometry'].overlaps(route['geometry']) and not part['geometry'].within(route['geometry']):
+                part['geometry'], route['geometry'] = part['geometry'].symmetric_difference(route['geometry'])
+                parts_to_merge.append(part)  # is a proper part, add to list for merging
+        # Stitch the parts together if there is a tail or a head, or both
+        if len(parts_to_merge) > 1:
+            full_route = linemerge(unary_union([part['geometry'] for part in parts_to_merge]))
+        else:
+            full_route = route['geometry']
+        prepared_routes.append({
+            'geometry': to_wgs84(full_route).coords,
+            'distance': sum(part['distance'] for part in parts_to_merge),
+            'duration': sum(part['duration'] for part in parts_to_merge)
+        })
+        prepared_route_buffers.append(
+            route['geometry'].buffer(app.config['ROUTE_BUFFER_SIZE'], cap_style=2)
+        )
     # User may opt to drive ad-hoc w/out preparing a route; if make_route is False, only the end points will be saved
     if request.json.get('make_route') is False:
         route_id = uuid4()
         route_wgs84 = LineString([start, finish])
-        route_geom = project(route_wgs84).wkt
-        db.session.add(Route(
-            id=route_id,
-            user_id=request.json['user_id'],
-            profile=request.json['profile'],
-            geom=route_geom,
-            geom_remainder=route_geom
-        ))
+        insert_routes([{
+            'id': route_id,
+            'user_id': request.json['user_id'],
+            'profile': request.json['profile'],
+            'geom': project(route_wgs84)
+        }])
         routes = FeatureCollection([Feature(route_id, route_wgs84)])
         route_buffers = FeatureCollection([
             Feature(route_id, to_wgs84(
@@ -312,26 +472,22 @@ def post_route():
             ))
         ])
     else:
-        routing_engine = globals()[app.config['GEO_ENGINE']]
-        routes = routing_engine.directions(positions, request.json['profile'], with_alternatives)
+        routes = directions(positions, request.json['profile'], with_alternatives)
         # Save routes to DB
         all_routes = routes + prepared_routes
         route_ids = [uuid4() for _ in all_routes]
-        for route, route_id in zip(all_routes, route_ids):
-            route_geom = project(LineString(route['geometry'])).wkt
-            db.session.add(Route(
-                id=route_id,
-                user_id=request.json['user_id'],
-                profile=request.json['profile'],
-                distance=route['distance'],
-                duration=route['duration'],
-                geom=route_geom,
-                geom_remainder=route_geom,
-                is_handled=(with_handles and len(positions) > 2)
-            ))
+        insert_routes([{
+            'id': route_id,
+            'user_id': request.json['user_id'],
+            'profile': request.json['profile'],
+            'distance': route['distance'],
+            'duration': route['duration'],
+            'geom': project(LineString(route['geometry'])),
+            'is_handled': with_handles and len(positions) > 2
+        } for route, route_id in zip(all_routes, route_ids)])
         if request.json['profile'] == 'driving-car' and with_handles:
             # Get midpoints of the route's last segment for the user to drag on the screen
-            routes_last_parts = routes if with_alternatives else routing_engine.directions(positions[-2:], request.json['profile'])
+            routes_last_parts = routes if with_alternatives else directions(positions[-2:], request.json['profile'])
             routes_last_parts = (route['geometry'] for route in routes_last_parts)
             handles = [LineString(route).interpolate(0.5, normalized=True) for route in routes_last_parts]
             handles = [Point(handle.coords[0]) for handle in handles]
@@ -366,14 +522,58 @@ def post_route():
     }
 
 
+@read_only
 def get_route(route_id):
-    route = Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE)
+    route = get_route_or_404(route_id, Route.geom)
     return route_to_feature(route)
 
 
+@read_only
+def batch_get_routes():
+    """Fetch many routes in a single query, w/ only the geometries asked for."""
+    route_ids = [str(route_id) for route_id in request.json['route_ids']]
+    fields = request.json.get('fields', ['geom'])
+    tolerance = request.json.get('simplify')
+    query = db.session.query(Route, *[
+        (func.ST_SimplifyPreserveTopology(getattr(Route, field), tolerance) if tolerance else getattr(Route, field))
+        .label(field)
+        for field in ('geom', 'geom_remainder') if field in fields
+    ])
+    for model, field in ((PickupPoint, 'pickup_point'), (DropoffPoint, 'dropoff_point')):
+        if field in fields:
+            query = query.outerjoin(
+                model, (model.route_id == Route.id) & (model.route_created_at == Route.created_at)
+            ).add_columns(model.geom.label(field))
+    query = query.filter(Route.id.in_(route_ids))
+    rows = query.all()
+    if len(rows) < len(set(route_ids)) and replica.in_use():  # some may have been just created by another worker
+        replica.use_primary()
+        rows = query.all()
+    order = {route_id: i for i, route_id in reversed(list(enumerate(route_ids)))}
+    rows.sort(key=lambda row: order[str(row.Route.id)])
+    return FeatureCollection([
+        Feature(
+            row.Route.id,
+            to_wgs84(to_shape(row.geom)) if 'geom' in fields else None,
+            {
+                **route_schema().dump(row.Route),
+                **{
+                    field: getattr(row, field) and mapping(to_wgs84(to_shape(getattr(row, field))))
+                    for field in fields if field != 'geom'
+                }
+            }
+        ) for row in rows
+    ])
+
+
 def put_route(route_id):
     route = Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE)
+    # Only a newly confirmed trip counts towards the corridor, not the same one confirmed again
+    new_trip = bool(request.json.get('trip_id')) and str(route.trip_id) != str(request.json['trip_id'])
     if request.json.get('trip_id'):
+        # The unique constraint only holds within a partition, so look across all of them
+        if Route.query.filter(Route.trip_id == request.json['trip_id'], Route.id != route_id).first():
+            abort(400, 'Such trip id already exists in the database')
         route.trip_id = request.json['trip_id']
     if request.json.get('positions'):
         positions = [position[::-1] for position in request.json['positions']]
@@ -390,6 +590,11 @@ def put_route(route_id):
     except Exception as e:
         db.session.rollback()
         abort(500, str(e))
+    replica.mark_written()
+    # A confirmed trip along a handled route updates the user's corridor for post_route to reuse
+    if new_trip and route.is_handled:
+        corridors.record(route)
+        db.session.commit()
     return Feature(
         route_id,
         route_geom,
@@ -408,14 +613,16 @@ def delete_route(route_id):
     except Exception as e:
         db.session.rollback()
         abort(500, str(e))
+    replica.mark_written()
 
 
+@read_only
 def get_candidates(route_id):
-    target_route = Route.query.get_or_404(route_id, ROUTE_NOT_FOUND_MESSAGE)
+    target_route = get_route_or_404(route_id, Route.geom_remainder)
     target_start = func.ST_StartPoint(target_route.geom_remainder)
     target_finish = func.ST_EndPoint(target_route.geom_remainder)
-    candidate_start = func.ST_StartPoint(Route.geom)
-    candidate_finish = func.ST_EndPoint(Route.geom)
+    candidate_start = Route.geom_start
+    candidate_finish = Route.geom_finish
     pickup_point = func.ST_LineLocatePoint(target_route.geom_remainder, candidate_start)
     dropoff_point = func.ST_LineLocatePoint(target_route.geom_remainder, candidate_finish)
     route_to_target = func.ST_ShortestLine(target_route.geom_remainder, candidate_start)
@@ -461,30 +668,64 @@ def get_candidates(route_id):
     return [route.id for route in candidate_routes]
 
 
+def geocode_text(text: str, focus) -> dict:
+    """The best match for the text, near the focus (lon, lat); raises IndexError if there's none."""
+    if app.config['GEO_ENGINE'] == 'rumap':
+        try:
+            return rumap.geocode(text, 'search', count=1, focus=focus)[0]
+        except (RequestException, rumap.QuotaExceeded):  # rumap failed or is out of quota, use ORS this time
+            pass
+    return ors.geocode(text, focus)
+
+
 def geocode(text, position=MOSCOW_CENTER):
     try:
-        if app.config['GEO_ENGINE'] == 'rumap':
-            try:
-                result = rumap.geocode(text, 'search', count=1, focus=parse_lat_lon(position))[0]
-            except HTTPError:  # rumap license expired or out of quota
-                app.config['GEO_ENGINE'] = 'ors'
-                geocode(text)
-        else:
-            result = ors.geocode(text, parse_lat_lon(position))
+        result = geocode_text(text, parse_lat_lon(position))
         return Feature(result['id'], result['geometry'], result['properties'])
     except IndexError:
         abort(404, 'Nothing found; try a different text')
 
 
+def batch_geocode():
+    """Geocode many texts, each one once however many times it's given, & up to GEOCODE_BATCH_CONCURRENCY at a time."""
+    default_focus = parse_lat_lon(MOSCOW_CENTER)
+    keys = [
+        (' '.join(item['text'].split()), tuple(item['position'][::-1]) if 'position' in item else default_focus)
+        for item in request.json['items']
+    ]
+    unique = list(dict.fromkeys(keys))
+    request_deadline = deadline.get()
+
+    def resolve(key):
+        with app.app_context():
+            deadline.set_to(request_deadline)
+            try:
+                result = geocode_text(*key)
+                return Feature(result['id'], result['geometry'], result['properties'])
+            except IndexError:
+                status, detail = 404, 'Nothing found; try a different text'
+            except HTTPException as e:
+                status, detail = e.code, e.description
+            except RequestException as e:
+                status, detail = 502, str(e)
+            except Exception as e:
+                app.logger.exception(f'Failed to geocode {key[0]!r}')
+                status, detail = 500, str(e)
+            return {'error': {'status': status, 'detail': detail}}
+
+    with ThreadPoolExecutor(min(app.config['GEOCODE_BATCH_CONCURRENCY'], len(unique))) as executor:
+        results = dict(zip(unique, executor.map(resolve, unique)))
+    return {'results': [results[key] for key in keys]}
+
+
 def suggest(text, position=MOSCOW_CENTER):
+    result = None
     if app.config['GEO_ENGINE'] == 'rumap':
         try:
             result = rumap.geocode(text, 'suggest', count=5, focus=parse_lat_lon(position))
-        except HTTPError:  # rumap license expired or out of quota
-            app.config['GEO_ENGINE'] = 'ors'
-            suggest(text)
-            return
-    else:
+        except (RequestException, rumap.QuotaExceeded):  # rumap failed or is out of quota, use ORS this time
+            pass
+    if result is None:
         result = ors.suggest(text, parse_lat_lon(position))
     if result:
         return FeatureCollection([
@@ -497,13 +738,14 @@ def suggest(text, position=MOSCOW_CENTER):
 def reverse_geocode(position, focus=MOSCOW_CENTER):
     routing_engine = globals()[app.config['GEO_ENGINE']]
     try:
+        if routing_engine is rumap:
+            try:
+                return rumap.reverse_geocode(parse_lat_lon(position), focus=parse_lat_lon(focus))
+            except (RequestException, rumap.QuotaExceeded):  # rumap failed or is out of quota, use ORS this time
+                routing_engine = ors
         return routing_engine.reverse_geocode(
             parse_lat_lon(position),
             focus=parse_lat_lon(focus)
         )
     except IndexError:
         abort(404, 'Nothing found')
-    except HTTPError:  # rumap license expired or out of quota
-        if app.config['GEO_ENGINE'] == 'rumap':  # switch to ORS
-            app.config['GEO_ENGINE'] = 'ors'
-            reverse_geocode(position)
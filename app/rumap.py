@@ -8,7 +8,8 @@ from geojson import Feature
 from shapely.geometry import LineString
 from shapely.ops import linemerge
 
-from app import app, helpers
+from app import app, helpers, metrics, quota, deadline
+from app.singleflight import coalesced
 
 
 RUMAP_ROUTING_URL = os.getenv('RUMAP_ROUTING_URL')
@@ -76,36 +77,62 @@ HIERARCHY = {
 }
 
 
+class QuotaExceeded(Exception):
+    """The key's rate limit or daily quota for the endpoint is used up; the call should go to ORS instead."""
+
+
+def daily_quotas() -> dict:
+    return {f'rumap_{endpoint}': daily for endpoint, daily in app.config['RUMAP_DAILY_QUOTAS'].items()}
+
+
+def acquire(endpoint: str):
+    """Count a call to the endpoint, raising QuotaExceeded if there are none left for now."""
+    if not quota.spend(
+        f'rumap_{endpoint}', app.config['RUMAP_RATE_LIMIT'], app.config['RUMAP_RATE_BURST'],
+        app.config['RUMAP_DAILY_QUOTAS'][endpoint], app.config['RUMAP_QUOTA_BATCH']
+    ):
+        raise QuotaExceeded(f'rumap {endpoint} quota is used up')
+
+
+def check(res: requests.Response, endpoint: str):
+    """Raise HTTPError if the call failed; once the key is out of quota, stop using it until tomorrow."""
+    try:
+        res.raise_for_status()
+    except HTTPError as e:
+        if res.status_code == 403:  # KEY expired or out of quota
+            quota.exhaust(f'rumap_{endpoint}', app.config['RUMAP_DAILY_QUOTAS'][endpoint])
+        raise e  # re-raise to submit the same request to ORS
+
+
+@coalesced('rumap')
 def directions(
     positions: list[list[float]],
     profile: str,
     alternatives: bool = False,
     geometry: bool = True
 ) -> list[dict]:
+    acquire('routing')
     positions = [{'x': position[0], 'y': position[1]} for position in positions]
-    res = requests.post(
-        RUMAP_ROUTING_URL + '/directions',
-        params={'license': KEY},
-        json={
-            'vehicles': {'pedestrian' if profile == 'foot-walking' else 'car': {}},
-            'points': positions,
-            'routeAlternative': alternatives,
-            'alternative': {
-                'alternativeUpperLimitFactor': 1.4,
-                'roadworksEnable': True
-            },
-            'speed': 'online',  # consider traffic
-            'return': ['summary'] + (['geometry'] if geometry else []),
-            'startingedgescount': 1,  # temp bug fix: awaits to be resolved by GeoCenter
-            'endingedgescount': 1,  # temp bug fix: awaits to be resolved by GeoCenter
-        }
-    )
-    try:
-        res.raise_for_status()
-    except HTTPError as e:
-        if res.status_code == 403:  # KEY expired or out of quota
-            app.config['GEO_ENGINE'] = 'ors'
-        raise e  # re-raise to submit the same request to ORS
+    with metrics.upstream('rumap', 'routing') as call:
+        res = deadline.send(
+            'POST', RUMAP_ROUTING_URL + '/directions',
+            params={'license': KEY},
+            json={
+                'vehicles': {'pedestrian' if profile == 'foot-walking' else 'car': {}},
+                'points': positions,
+                'routeAlternative': alternatives,
+                'alternative': {
+                    'alternativeUpperLimitFactor': 1.4,
+                    'roadworksEnable': True
+                },
+                'speed': 'online',  # consider traffic
+                'return': ['summary'] + (['geometry'] if geometry else []),
+                'startingedgescount': 1,  # temp bug fix: awaits to be resolved by GeoCenter
+                'endingedgescount': 1,  # temp bug fix: awaits to be resolved by GeoCenter
+            }
+        )
+        call['status'] = res.status_code
+    check(res, 'routing')
     res = res.json()
     if not alternatives:
         res = [res]  # wrap single feature in a list for consistency
@@ -160,25 +187,24 @@ def parse(properties: dict) -> dict:
     }
 
 
+@coalesced('rumap')
 def geocode(text: str, mode: str, count: int, focus: Iterable):
     """"""
-    res = requests.get(
-        url=RUMAP_FORWARD_GEOCODING_URL + '/' + mode,
-        params={
-            'guid': KEY,
-            'text': text,
-            'format': 'geojson:full',
-            'count': count,
-            'x': focus[0],
-            'y': focus[1],
-        }
-    )
-    try:
-        res.raise_for_status()
-    except HTTPError as e:
-        if res.status_code == 403:  # rumap KEY has expired or out of quota
-            app.config['GEO_ENGINE'] = 'ors'  # switch to ORS
-        raise e  # re-raise for the route handler to retry using ORS
+    acquire('forward')
+    with metrics.upstream('rumap', mode) as call:
+        res = deadline.send(
+            'GET', RUMAP_FORWARD_GEOCODING_URL + '/' + mode,
+            params={
+                'guid': KEY,
+                'text': text,
+                'format': 'geojson:full',
+                'count': count,
+                'x': focus[0],
+                'y': focus[1],
+            }
+        )
+        call['status'] = res.status_code
+    check(res, 'forward')
     results = sorted(
         res.json()['features'],
         key=lambda i: i['properties']['accuracy'],
@@ -203,25 +229,24 @@ def geocode(text: str, mode: str, count: int, focus: Iterable):
     ]
 
 
+@coalesced('rumap')
 def reverse_geocode(location: Iterable, focus: Iterable) -> dict:
     """Kwargs added so that focus point can be passed just as w/ ORS w/out raising an error."""
-    res = requests.get(
-        url=RUMAP_REVERSE_GEOCODING_URL + '/getAddress',
-        params={
-            'guid': KEY,
-            'x': location[0],
-            'y': location[1],
-            'format': 'geojson:full',
-            'pattern': 'nearest',
-            'maxdist': 150
-        }
-    )
-    try:
-        res.raise_for_status()
-    except HTTPError as e:
-        if res.status_code == 403:  # KEY expired or out of quota
-            app.config['GEO_ENGINE'] = 'ors'
-        raise e  # re-raise to submit the same request to ORS
+    acquire('reverse')
+    with metrics.upstream('rumap', 'reverse') as call:
+        res = deadline.send(
+            'GET', RUMAP_REVERSE_GEOCODING_URL + '/getAddress',
+            params={
+                'guid': KEY,
+                'x': location[0],
+                'y': location[1],
+                'format': 'geojson:full',
+                'pattern': 'nearest',
+                'maxdist': 150
+            }
+        )
+        call['status'] = res.status_code
+    check(res, 'reverse')
     feature = res.json()['features'][0]
     if feature['properties']['type'] in HIERARCHY and (
         feature['properties'].get('RSNM') in SUPPORTED_REGIONS
@@ -235,3 +260,7 @@ def reverse_geocode(location: Iterable, focus: Iterable) -> dict:
         return feature
     else:
         abort(404, 'Nothing found; try a different text')
+
+
+# Calls left today, as a gauge
+metrics.register(quota.RemainingCollector(daily_quotas))
@@ -6,4 +6,4 @@ class RouteSchema(ma.SQLAlchemyAutoSchema):
     """"""
     class Meta:
         model = Route
-        exclude = 'geom', 'geom_remainder', 'pickup_point', 'dropoff_point'
+        exclude = 'geom', 'geom_remainder', 'geom_start', 'geom_finish', 'pickup_point', 'dropoff_point'
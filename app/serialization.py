@@ -0,0 +1,39 @@
+"""JSON for API responses, via orjson rather than Flask's encoder on top of the stdlib `json`.
+
+geojson objects are dicts, & UUIDs, datetimes & NumPy arrays are serialized natively; Shapely
+geometries are written from their `__geo_interface__`, so they can be returned as they are.
+"""
+import sys
+
+import orjson
+from shapely.coords import CoordinateSequence
+from connexion.apis.flask_api import FlaskApi
+from connexion.jsonifier import Jsonifier
+
+
+# Naive datetimes are UTC here; mark them w/ a Z, as connexion's encoder did
+OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+
+def default(obj):
+    """Serialize what orjson doesn't know."""
+    if hasattr(obj, '__geo_interface__'):  # e.g. Shapely geometries
+        return obj.__geo_interface__
+    if isinstance(obj, CoordinateSequence):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def dumps(obj, **kwargs) -> str:
+    """Same as `json.dumps`, but ignoring formatting args; connexion wants a str."""
+    return orjson.dumps(obj, default=default, option=OPTIONS).decode()
+
+
+loads = orjson.loads
+
+
+class OrjsonApi(FlaskApi):
+    @classmethod
+    def _set_jsonifier(cls):
+        """Used by connexion to (de)serialize request & response bodies, & problems."""
+        cls.jsonifier = Jsonifier(json_=sys.modules[__name__])
@@ -0,0 +1,59 @@
+"""Single-flight calls to upstream services: identical concurrent calls within a worker share one.
+
+E.g. when many passengers open the same event's location at once, only the first request for it goes
+upstream; the others wait for its result, or its error, & get a copy of it.
+"""
+import copy
+import threading
+import functools
+
+from app import metrics, deadline
+
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiting = 0
+        self.result = None
+        self.error = None
+
+
+_calls = {}  # (function, its args) -> the call in flight
+_lock = threading.Lock()
+
+
+def coalesced(engine: str):
+    """Have identical concurrent calls of the decorated function share the first one's result."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (function.__module__, function.__qualname__, repr(args), repr(sorted(kwargs.items())))
+            with _lock:
+                call = _calls.get(key)
+                leading = call is None
+                if leading:
+                    call = _calls[key] = Call()
+                else:
+                    call.waiting += 1
+            if not leading:
+                metrics.UPSTREAM_COALESCED.labels(engine, function.__name__).inc()
+                if not call.done.wait(deadline.left()):  # the first call has its own deadline, this one may be sooner
+                    deadline.expired()
+                if call.error is not None:
+                    raise call.error
+                return copy.deepcopy(call.result)  # callers may modify what they get
+            result = None
+            try:
+                result = function(*args, **kwargs)
+                return result
+            except Exception as e:  # incl. aborts, which are passed on as they are
+                call.error = e
+                raise
+            finally:
+                with _lock:
+                    del _calls[key]
+                if call.waiting:  # a copy, before this caller gets to modify the result
+                    call.result = copy.deepcopy(result)
+                call.done.set()
+        return wrapper
+    return decorator
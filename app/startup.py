@@ -0,0 +1,99 @@
+"""Startup timing & the things that make startup cheaper.
+
+Imported first by the package, so the report covers the whole import of the app.
+"""
+import os
+import json
+import time
+import hashlib
+
+import yaml
+import jinja2
+
+
+STARTED = time.perf_counter()
+SPEC_CACHE_DIR = os.getenv(
+    'SPEC_CACHE_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.spec-cache')
+)
+laps = {}
+_last = STARTED
+
+
+def lap(name: str):
+    """Record the time spent since the previous lap as the `name` phase of startup."""
+    global _last
+    now = time.perf_counter()
+    laps[name] = now - _last
+    _last = now
+
+
+def report() -> str:
+    phases = ', '.join(f'{name} {duration:.2f} s' for name, duration in laps.items())
+    return f'Started in {_last - STARTED:.2f} s: {phases}'
+
+
+def encode(obj):
+    """The spec as JSON-compatible data; dicts w/ non-string keys, e.g. status codes, become lists of pairs."""
+    if isinstance(obj, dict):
+        if all(isinstance(key, str) for key in obj):
+            return {key: encode(value) for key, value in obj.items()}
+        return {'__pairs__': [[key, encode(value)] for key, value in obj.items()]}
+    if isinstance(obj, list):
+        return [encode(item) for item in obj]
+    return obj
+
+
+def decode(obj: dict):
+    return dict(obj['__pairs__']) if '__pairs__' in obj else obj
+
+
+def is_private(directory: str) -> bool:
+    """Whether only this user can write to the directory, i.e. change the specs cached there."""
+    stat = os.stat(directory)
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+
+def load_spec(path: str, arguments: dict) -> dict:
+    """Render & parse an API spec the way connexion does, caching the result.
+
+    The cache is keyed by the rendered spec, so it's refreshed by changes to both the file &
+    the config values it refers to. Only rendering & parsing are saved: connexion still validates the
+    spec & resolves its $refs in each worker.
+    """
+    with open(path, encoding='utf-8') as f:
+        rendered = jinja2.Template(f.read()).render(**arguments)
+    cached = os.path.join(SPEC_CACHE_DIR, hashlib.sha1(rendered.encode()).hexdigest() + '.json')
+    try:
+        if is_private(SPEC_CACHE_DIR):
+            with open(cached, encoding='utf-8') as f:
+                return json.load(f, object_hook=decode)
+    except (OSError, ValueError):
+        pass
+    spec = yaml.safe_load(rendered)
+    try:
+        os.makedirs(SPEC_CACHE_DIR, mode=0o700, exist_ok=True)
+        if is_private(SPEC_CACHE_DIR):
+            # Written aside & renamed, so that workers starting together never read a partial file
+            with open(f'{cached}.{os.getpid()}', 'w', encoding='utf-8') as f:
+                json.dump(encode(spec), f)
+            os.replace(f'{cached}.{os.getpid()}', cached)
+    except OSError:
+        pass  # e.g. a read-only file system; the spec just gets parsed every time
+    return spec
+
+
+def warm_up():
+    """Build what's otherwise built on first use, e.g. in a preloading parent for workers to share."""
+    from app import app, db, helpers, stops, local
+
+    helpers.route_schema()
+    helpers.transformer(4326, app.config['PROJECTION'])
+    helpers.transformer(app.config['PROJECTION'], 4326)
+    with app.app_context():
+        stops.get()
+        if app.config['GEO_ENGINE'] == 'local':
+            local.get()
+        # Forked workers mustn't share the parent's DB connections
+        for bind in [None, *app.config['SQLALCHEMY_BINDS']]:
+            db.get_engine(app, bind=bind).dispose()
+    lap('warm-up')
@@ -0,0 +1,61 @@
+import time
+import threading
+
+import numpy as np
+from geoalchemy2.shape import to_shape
+
+from app import app
+from app.grid import GridIndex
+from app.helpers import to_wgs84, table_version
+from app.models import PublicTransportStop
+
+
+class StopIndex(GridIndex):
+    """Public transport stops w/ their projected & WGS84 coordinates, indexed by the former."""
+    def __init__(self, ids: list, names: list, coords: np.ndarray, wgs84: np.ndarray, cell_size: float):
+        super().__init__(coords, cell_size)
+        self.ids = ids
+        self.names = names
+        self.wgs84 = wgs84
+
+
+_index = None
+_version = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def load() -> StopIndex:
+    """Read all the stops from the DB into a fresh index."""
+    global _index, _version, _checked_at
+    with _lock:
+        version = table_version(PublicTransportStop)
+        stops = [
+            (stop.id, stop.name, to_shape(stop.geom))
+            for stop in PublicTransportStop.query.order_by(PublicTransportStop.id)
+        ]
+        coords = np.array([point.coords[0] for *_, point in stops], dtype=np.float64).reshape(-1, 2)
+        wgs84 = np.array([to_wgs84(point).coords[0] for *_, point in stops], dtype=np.float64).reshape(-1, 2)
+        _index = StopIndex(
+            [id_ for id_, *_ in stops], [name for _, name, _ in stops], coords, wgs84,
+            app.config['STOP_INDEX_CELL_SIZE']
+        )
+        _version, _checked_at = version, time.monotonic()
+    return _index
+
+
+def get() -> StopIndex:
+    """Get the stop index, reloading it if the stops table has changed since it was built."""
+    global _checked_at
+    if _index is None:
+        return load()
+    if time.monotonic() - _checked_at > app.config['STOP_INDEX_CHECK_INTERVAL']:
+        _checked_at = time.monotonic()
+        if table_version(PublicTransportStop) != _version:
+            return load()
+    return _index
+
+
+@app.before_first_request
+def warm_up():
+    get()
@@ -0,0 +1,67 @@
+import random
+
+from connexion.decorators.response import ResponseValidator
+from connexion.exceptions import NonConformingResponseBody, NonConformingResponseHeaders
+from connexion.json_schema import Draft4ResponseValidator
+from jsonschema import ValidationError, draft4_format_checker
+
+from app import app
+
+
+def truncated(data, max_items: int):
+    """A copy of the data w/ arrays cut to their first `max_items` items, e.g. route coordinates."""
+    if isinstance(data, dict):
+        return {key: truncated(value, max_items) for key, value in data.items()}
+    if isinstance(data, list):
+        return [truncated(item, max_items) for item in data[:max_items or None]]
+    return data
+
+
+def min_items(schema) -> int:
+    """The largest `minItems` in the schema, not to cut any array below what it requires, e.g. positions."""
+    if isinstance(schema, dict):
+        return max([schema.get('minItems', 0)] + [min_items(value) for value in schema.values()])
+    if isinstance(schema, list):
+        return max([min_items(value) for value in schema], default=0)
+    return 0
+
+
+class SampledResponseValidator(ResponseValidator):
+    """Validates a fraction of responses, & only the first items of their arrays, w/ validators built once.
+
+    Keeps response validation on in staging w/out it dominating the timings there.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.validators = {}  # by status code, w/ the schema's largest minItems
+
+    def validate_response(self, data, status_code, headers, url):
+        if random.random() >= app.config['RESPONSE_VALIDATION_SAMPLE_RATE']:
+            return True
+        schema = self.operation.response_schema(str(status_code), headers)
+        if data and self.is_json_schema_compatible(schema):
+            if status_code not in self.validators:
+                self.validators[status_code] = (self.validator or Draft4ResponseValidator)(
+                    schema, format_checker=draft4_format_checker
+                ), min_items(schema)
+            validator, least_items = self.validators[status_code]
+            body = self.operation.json_loads(data)
+            if app.config['RESPONSE_VALIDATION_MAX_ITEMS']:
+                body = truncated(body, max(app.config['RESPONSE_VALIDATION_MAX_ITEMS'], least_items))
+            try:
+                validator.validate(body)
+            except ValidationError as e:
+                raise NonConformingResponseBody(message=str(e))
+        self.validate_headers(status_code, headers)
+        return True
+
+    def validate_headers(self, status_code, headers):
+        """Same check of the required headers as connexion's, which comes w/ its validation of the body."""
+        definition = self.operation.response_definition(str(status_code), {})
+        missing = {
+            key for key, header in (definition or {}).get('headers', {}).items() if header.get('required', False)
+        } - set(headers.keys())
+        if missing:
+            raise NonConformingResponseHeaders(
+                message="Keys in header don't match response specification. Missing: " + ', '.join(missing)
+            )
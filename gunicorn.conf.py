@@ -0,0 +1,58 @@
+"""Gunicorn settings, picked up automatically from the working directory.
+
+See https://docs.gunicorn.org/en/stable/settings.html
+"""
+import os
+import glob
+
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+# Cooperative workers keep serving other requests while one waits on ORS, Pelias or rumap;
+# set to 'sync' to go back to one request per worker at a time
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 200))  # concurrent requests per worker
+# Load & warm up the app once, then fork workers that share its memory & start serving right away;
+# prefer this to `--preload`, which is read too late to patch for gevent in time
+preload_app = os.getenv('GUNICORN_PRELOAD', '').lower() in ('1', 'true')
+
+if preload_app and worker_class == 'gevent':
+    # Patch before the app imports anything, as the workers would only do it after forking
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def when_ready(server):
+    """Warm up the preloaded app before forking, so that workers inherit its caches."""
+    if server.cfg.preload_app:
+        from app import startup
+        startup.warm_up()
+        server.log.info(startup.report())
+
+
+def post_worker_init(worker):
+    """Log how long the worker took to load the app."""
+    if not worker.cfg.preload_app:
+        from app import startup
+        worker.log.info(startup.report())
+
+
+def post_fork(server, worker):
+    """Make psycopg2 yield to other greenlets while waiting on Postgres, the way patched sockets do."""
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def on_starting(server):
+    """Clear metrics left by the workers of a previous run."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        for path in glob.glob(os.path.join(os.environ['PROMETHEUS_MULTIPROC_DIR'], '*.db')):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    """Drop the exited worker's live gauges, e.g. DB pool usage, from the aggregate."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,192 @@
+"""Replay a realistic mix of API traffic and report throughput & latency per endpoint.
+
+Run the API against the upstream stub (see stub.py & docker-compose.yml in this dir), then:
+
+    python loadtest/run.py --url http://localhost:5000 --users 50 --duration 60 --output a.json
+
+Save runs of two commits and compare them:
+
+    python loadtest/run.py compare a.json b.json
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+from uuid import uuid4
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+# Trips around central Moscow, as [lat, lon]
+PLACES = [
+    [55.7607101, 37.5779111], [55.7586991, 37.6193321], [55.7594871, 37.6258311], [55.7303041, 37.6012611],
+    [55.7776731, 37.5843921], [55.7415421, 37.6560861], [55.7887001, 37.6781011], [55.7101241, 37.5520041]
+]
+ADDRESSES = ['Тверская улица 1', 'Новый Арбат 15', 'Пятницкая улица 20', 'Ленинский проспект 30']
+
+
+class Recorder:
+    """Collects request timings by endpoint."""
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def call(self, session: requests.Session, method: str, url: str, endpoint: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=30, **kwargs)
+            failed = response.status_code >= 500
+        except requests.RequestException:
+            response, failed = None, True
+        with self.lock:
+            self.timings[endpoint].append(time.perf_counter() - start)
+            if failed:
+                self.errors[endpoint] += 1
+        return response
+
+
+class Scenarios:
+    """Scripts of what a single user does; each takes one 'session' of the app."""
+    def __init__(self, url: str, recorder: Recorder, think_time: float):
+        self.url, self.recorder, self.think_time = url, recorder, think_time
+        self.driver_routes = []  # shared between users so that passengers have candidates to poll
+
+    def pause(self):
+        time.sleep(random.uniform(0, 2 * self.think_time))
+
+    def driver_trip(self, session):
+        start, finish = random.sample(PLACES, 2)
+        response = self.recorder.call(session, 'POST', f'{self.url}/routes', 'POST /routes', json={
+            'positions': [start, finish], 'profile': 'driving-car', 'user_id': str(uuid4())
+        })
+        if response is None or response.status_code != 200:
+            return
+        route = response.json()['routes']['features'][0]
+        self.driver_routes = (self.driver_routes + [route['id']])[-50:]
+        # Remainder pings as the driver moves along the route
+        for lon, lat in route['geometry']['coordinates'][::max(len(route['geometry']['coordinates']) // 5, 1)]:
+            self.pause()
+            self.recorder.call(
+                session, 'POST', f'{self.url}/routes/{route["id"]}/remainder', 'POST /routes/{id}/remainder',
+                json={'position': [lat, lon]}
+            )
+
+    def passenger_polling(self, session):
+        start, finish = random.sample(PLACES, 2)
+        response = self.recorder.call(session, 'POST', f'{self.url}/routes', 'POST /routes (passenger)', json={
+            'positions': [start, finish], 'profile': 'foot-walking', 'user_id': str(uuid4()), 'make_route': False
+        })
+        if response is None or response.status_code != 200:
+            return
+        route_id = response.json()['routes']['features'][0]['id']
+        for _ in range(5):
+            self.pause()
+            self.recorder.call(
+                session, 'POST', f'{self.url}/routes/{route_id}/candidates', 'POST /routes/{id}/candidates',
+                json={'candidate_route_ids': self.driver_routes[-20:]}
+            )
+
+    def suggest_typing(self, session):
+        address = random.choice(ADDRESSES)
+        for length in range(3, len(address) + 1, 2):  # a burst of keystrokes
+            time.sleep(random.uniform(0.05, 0.2))
+            self.recorder.call(
+                session, 'GET', f'{self.url}/suggest', 'GET /suggest',
+                params={'text': address[:length], 'position': '55.754801,37.622311'}
+            )
+
+
+MIX = {'driver_trip': 3, 'passenger_polling': 3, 'suggest_typing': 4}
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)] * 1000 if values else 0.0
+
+
+def run(args) -> dict:
+    recorder = Recorder()
+    scenarios = Scenarios(args.url.rstrip('/'), recorder, args.think_time)
+    deadline = time.monotonic() + args.duration
+
+    def user():
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            name = random.choices(list(MIX), weights=list(MIX.values()))[0]
+            getattr(scenarios, name)(session)
+
+    random.seed(args.seed)
+    started = time.monotonic()
+    with ThreadPoolExecutor(args.users) as pool:
+        for _ in range(args.users):
+            pool.submit(user)
+    elapsed = time.monotonic() - started
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'url': args.url,
+        'users': args.users,
+        'duration': round(elapsed, 1),
+        'endpoints': {
+            endpoint: {
+                'count': len(timings),
+                'errors': recorder.errors[endpoint],
+                'rps': round(len(timings) / elapsed, 2),
+                'p50': round(percentile(timings, .50), 1),
+                'p95': round(percentile(timings, .95), 1),
+                'p99': round(percentile(timings, .99), 1)
+            } for endpoint, timings in sorted(recorder.timings.items())
+        }
+    }
+
+
+def report(result: dict):
+    print(f'commit {result["commit"]}, {result["users"]} users, {result["duration"]} s')
+    print(f'{"endpoint":<34}{"count":>8}{"errors":>8}{"rps":>9}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for endpoint, stats in result['endpoints'].items():
+        print(f'{endpoint:<34}{stats["count"]:>8}{stats["errors"]:>8}{stats["rps"]:>9}'
+              f'{stats["p50"]:>10}{stats["p95"]:>10}{stats["p99"]:>10}')
+
+
+def compare(a: dict, b: dict):
+    print(f'{a["commit"]} -> {b["commit"]}, change in %')
+    print(f'{"endpoint":<34}{"rps":>9}{"p50":>9}{"p95":>9}{"p99":>9}')
+    for endpoint in sorted(set(a['endpoints']) & set(b['endpoints'])):
+        before, after = a['endpoints'][endpoint], b['endpoints'][endpoint]
+        changes = [
+            f'{(after[stat] - before[stat]) / before[stat] * 100:+.1f}' if before[stat] else 'n/a'
+            for stat in ('rps', 'p50', 'p95', 'p99')
+        ]
+        print(f'{endpoint:<34}' + ''.join(f'{change:>9}' for change in changes))
+
+
+def main():
+    if sys.argv[1:2] == ['compare']:
+        a, b = (json.loads(open(path).read()) for path in sys.argv[2:4])
+        return compare(a, b)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--users', type=int, default=20, help='number of concurrent simulated users')
+    parser.add_argument('--duration', type=float, default=60, help='in seconds')
+    parser.add_argument('--think-time', type=float, default=0.5, help='mean pause between user actions in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='save the results as JSON, e.g. to compare runs later')
+    args = parser.parse_args()
+    result = run(args)
+    report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
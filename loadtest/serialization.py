@@ -0,0 +1,73 @@
+"""Compare the JSON serialization of responses: connexion's default path vs app.serialization.
+
+Payloads are built the way post_route & get_stops build theirs. Needs the app's environment, e.g.
+
+    docker-compose run --rm -v $PWD/loadtest:/app/loadtest api python loadtest/serialization.py
+"""
+import os
+import sys
+import timeit
+import argparse
+from uuid import uuid4
+
+import flask
+from connexion.jsonifier import Jsonifier
+from geojson import Feature, FeatureCollection
+from shapely.geometry import Point, LineString
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app, serialization  # noqa: E402
+
+
+def route_set(count: int, vertices: int) -> FeatureCollection:
+    return FeatureCollection([
+        Feature(
+            id=uuid4(),
+            geometry=LineString([(37.6 + i / 10 ** 4, 55.75 + (i * n % 7) / 10 ** 4) for i in range(vertices)]),
+            properties={'distance': 12345.6, 'duration': 1234.5}
+        ) for n in range(count)
+    ])
+
+
+def post_route_payload(vertices: int) -> dict:
+    buffers = FeatureCollection([
+        Feature(id=feature['id'], geometry=LineString(feature['geometry']['coordinates']).buffer(.0005, cap_style=2))
+        for feature in route_set(3, vertices)['features']
+    ])
+    return {
+        'routes': route_set(3, vertices),
+        'handles': FeatureCollection([Feature(uuid4(), Point(37.6, 55.75)) for _ in range(3)]),
+        'prepared_routes': route_set(2, vertices),
+        'route_buffers': buffers,
+        'prepared_route_buffers': route_set(2, vertices)
+    }
+
+
+def get_stops_payload(stops: int) -> FeatureCollection:
+    return FeatureCollection([
+        Feature(n, Point(37.6 + n / 10 ** 5, 55.75), {'name': f'Остановка {n}'}) for n in range(stops)
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vertices', type=int, default=2000, help='per route in the post_route payload')
+    parser.add_argument('--stops', type=int, default=5000, help='in the get_stops payload')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    current = Jsonifier(flask.json, indent=2)  # what connexion's FlaskApi uses by default
+    payloads = {'post_route': post_route_payload(args.vertices), 'get_stops': get_stops_payload(args.stops)}
+    print(f'{"payload":<12}{"size KB":>10}{"current ms":>12}{"orjson ms":>12}{"speedup":>10}')
+    with app.app_context():
+        for name, payload in payloads.items():
+            assert flask.json.loads(current.dumps(payload)) == flask.json.loads(serialization.dumps(payload))
+            timings = [
+                min(timeit.repeat(lambda: dumps(payload), number=1, repeat=args.repeat)) * 1000
+                for dumps in (current.dumps, serialization.dumps)
+            ]
+            size = len(serialization.dumps(payload)) / 1024
+            print(f'{name:<12}{size:>10.0f}{timings[0]:>12.1f}{timings[1]:>12.1f}{timings[0] / timings[1]:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
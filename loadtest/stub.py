@@ -0,0 +1,211 @@
+"""Deterministic stand-in for ORS, Pelias & rumap, to load-test the API w/out hitting the real services.
+
+Services are told apart by path prefix, so point the API at it like this:
+
+    ORS_ENDPOINT=http://stub:8080/ors
+    PELIAS_ENDPOINT=http://stub:8080/pelias
+    RUMAP_ROUTING_URL=http://stub:8080/rumap
+    RUMAP_FORWARD_GEOCODING_URL=http://stub:8080/rumap
+    RUMAP_REVERSE_GEOCODING_URL=http://stub:8080/rumap
+
+Recorded responses are replayed for the requests they were recorded for; other requests get a
+synthetic response computed from the request itself. Record real responses by proxying through it:
+
+    python loadtest/stub.py --record ors=http://ors:8080/ors --record pelias=https://pelias.example
+"""
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+
+SECRET_PARAMS = {'api_key', 'license', 'guid'}  # not part of a recording's key
+
+
+def request_key(method: str, path: str, query: str, body: bytes) -> str:
+    params = sorted((k, v) for k, v in parse_qsl(query) if k not in SECRET_PARAMS)
+    return hashlib.sha1(json.dumps([method, path, params, body.decode()]).encode()).hexdigest()
+
+
+def distance(a, b) -> float:
+    """Haversine distance in meters between two [lon, lat] positions."""
+    lon1, lat1, lon2, lat2 = map(math.radians, [*a, *b])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(h))
+
+
+def line(positions: list, offset: float = 0.0, steps: int = 10) -> list:
+    """A route through the positions w/ intermediate vertices, shifted sideways by `offset` degrees."""
+    coordinates = []
+    for (x1, y1), (x2, y2) in zip(positions, positions[1:]):
+        for step in range(steps):
+            t = step / steps
+            bend = math.sin(math.pi * t) * offset
+            coordinates.append([x1 + (x2 - x1) * t + bend, y1 + (y2 - y1) * t + bend])
+    return coordinates + [list(positions[-1])]
+
+
+def length(coordinates: list) -> float:
+    return sum(distance(a, b) for a, b in zip(coordinates, coordinates[1:]))
+
+
+def ors_directions(body: dict, query: dict) -> dict:
+    alternatives = body.get('alternative_routes') or {}
+    features = []
+    for n in range(alternatives.get('target_count', 1)):
+        coordinates = line(body['coordinates'], offset=0.002 * n)
+        meters = length(coordinates)
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': coordinates},
+            'properties': {'summary': {'distance': meters, 'duration': meters / 10}}
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def ors_matrix(body: dict, query: dict) -> dict:
+    locations = body['locations']
+    return {'durations': [
+        [distance(locations[source], locations[destination]) / 1.4 for destination in body['destinations']]
+        for source in body['sources']
+    ]}
+
+
+def pelias_features(text: str, lon: float, lat: float, count: int) -> dict:
+    seed = int(hashlib.sha1(text.encode()).hexdigest(), 16)
+    return {'features': [{
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [lon + (seed % 97 - 48) / 5000 + n / 1000, lat + (seed % 89 - 44) / 5000]},
+        'properties': {
+            'id': f'node/{seed % 10 ** 9 + n}',
+            'name': f'{text} {n + 1}',
+            'locality': 'Москва',
+            'region': 'Moscow City'
+        }
+    } for n in range(count)]}
+
+
+def pelias_search(body: dict, query: dict) -> dict:
+    return pelias_features(query.get('text', ''), float(query['focus.point.lon']), float(query['focus.point.lat']), int(query.get('size', 1)))
+
+
+def pelias_autocomplete(body: dict, query: dict) -> dict:
+    return pelias_features(query.get('text', ''), float(query['focus.point.lon']), float(query['focus.point.lat']), 5)
+
+
+def pelias_reverse(body: dict, query: dict) -> dict:
+    return pelias_features('Тверская', float(query['point.lon']), float(query['point.lat']), 1)
+
+
+def rumap_directions(body: dict, query: dict):
+    positions = [[point['x'], point['y']] for point in body['points']]
+    routes = []
+    for n in range(3 if body.get('routeAlternative') else 1):
+        coordinates = line(positions, offset=0.002 * n)
+        meters = length(coordinates)
+        routes.append({
+            'properties': {'length': meters, 'time': meters / 10},
+            'features': [{'geometry': {'type': 'LineString', 'coordinates': coordinates}}]
+        })
+    return routes if body.get('routeAlternative') else routes[0]
+
+
+def rumap_geocode(body: dict, query: dict) -> dict:
+    text, x, y = query.get('text', ''), float(query['x']), float(query['y'])
+    return {'features': [{
+        'geometry': {'type': 'Point', 'coordinates': [x + n / 1000, y + n / 1000]},
+        'properties': {'dataType': 'poi', 'NAME': f'{text} {n + 1}', 'ADDRESS': 'Москва', 'accuracy': 1 - n / 10}
+    } for n in range(int(query.get('count', 1)))]}
+
+
+def rumap_reverse(body: dict, query: dict) -> dict:
+    return {'features': [{
+        'geometry': {'type': 'Point', 'coordinates': [float(query['x']), float(query['y'])]},
+        'properties': {'type': 'address', 'STFNM': 'Тверская улица', 'A_NUM': '1', 'CTSNM': 'Москва', 'RSNM': 'Москва'}
+    }]}
+
+
+SYNTHETIC = {
+    ('POST', '/ors/v2/directions'): ors_directions,
+    ('POST', '/ors/v2/matrix'): ors_matrix,
+    ('GET', '/pelias/search'): pelias_search,
+    ('GET', '/pelias/autocomplete'): pelias_autocomplete,
+    ('GET', '/pelias/reverse'): pelias_reverse,
+    ('POST', '/rumap/directions'): rumap_directions,
+    ('GET', '/rumap/search'): rumap_geocode,
+    ('GET', '/rumap/suggest'): rumap_geocode,
+    ('GET', '/rumap/getAddress'): rumap_reverse,
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    recordings: dict = {}
+    recordings_dir: Path = None
+    upstreams: dict = {}
+    latency: float = 0.0
+    jitter: float = 0.0
+
+    def log_message(self, *args):
+        pass  # keep the output for the load-test report
+
+    def respond(self, status: int, payload: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def handle_request(self):
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        key = request_key(self.command, url.path, url.query, body)
+        # The same request always waits the same time, so runs are comparable
+        delay = self.latency + random.Random(key).uniform(-self.jitter, self.jitter)
+        time.sleep(max(delay, 0) / 1000)
+        service = url.path.strip('/').split('/')[0]
+        if service in self.upstreams:
+            res = requests.request(
+                self.command, self.upstreams[service] + url.path[len(service) + 1:] + (f'?{url.query}' if url.query else ''),
+                data=body or None, headers={'Content-Type': self.headers.get('Content-Type', 'application/json')}
+            )
+            (self.recordings_dir / f'{key}.json').write_text(json.dumps({'status': res.status_code, 'body': res.text}))
+            return self.respond(res.status_code, res.content)
+        if key in self.recordings:
+            return self.respond(self.recordings[key]['status'], self.recordings[key]['body'].encode())
+        for (method, prefix), synthesize in SYNTHETIC.items():
+            if self.command == method and url.path.startswith(prefix):
+                query = dict(parse_qsl(url.query))
+                payload = synthesize(json.loads(body) if body else {}, query)
+                return self.respond(200, json.dumps(payload).encode())
+        self.respond(404, b'{"error": "no recording or synthetic response for this request"}')
+
+    do_GET = do_POST = handle_request
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=50, help='response delay in ms')
+    parser.add_argument('--jitter', type=float, default=20, help='max random deviation from the delay in ms')
+    parser.add_argument('--recordings', type=Path, default=Path(__file__).parent / 'recordings')
+    parser.add_argument('--record', action='append', default=[], metavar='SERVICE=URL',
+                        help='proxy a service (ors, pelias or rumap) to URL and record its responses')
+    args = parser.parse_args()
+    args.recordings.mkdir(parents=True, exist_ok=True)
+    StubHandler.recordings_dir = args.recordings
+    StubHandler.recordings = {path.stem: json.loads(path.read_text()) for path in args.recordings.glob('*.json')}
+    StubHandler.upstreams = dict(upstream.split('=', 1) for upstream in args.record)
+    StubHandler.latency, StubHandler.jitter = args.latency, args.jitter
+    print(f'Serving {len(StubHandler.recordings)} recordings on :{args.port}')
+    ThreadingHTTPServer(('0.0.0.0', args.port), StubHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
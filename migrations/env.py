@@ -1,3 +1,4 @@
+import re
 import logging
 from logging.config import fileConfig
 
@@ -17,11 +18,13 @@ config.set_main_option('sqlalchemy.url', str(migrate.db.engine.url))
 target_metadata = migrate.db.metadata
 # Ignore 'static' table baked into custom postgis image so alembic doesn't drop them
 exclude_tables = config.get_section('exclude').get('tables', '').split(',')
+# Partitions are managed by `flask routes partition/archive` rather than by migrations
+partition_pattern = re.compile(r'^(route|pickup_point|dropoff_point)_(p\d{4}_\d{2}|default)$')
 
 
 def include_object(_, name, type_, *args):
     """Check if the passed object, e.g. table, is excluded from monitoring."""
-    return not (type_ == 'table' and name in exclude_tables)
+    return not (type_ == 'table' and (name in exclude_tables or partition_pattern.match(name)))
 
 
 def run_migrations():
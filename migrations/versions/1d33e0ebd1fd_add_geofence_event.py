@@ -0,0 +1,33 @@
+"""
+Message: Add geofence_event
+Revision ID: 1d33e0ebd1fd
+Revises: 6125a904dfa3
+Create Date: 2026-10-19 18:00:00.000000
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+revision = '1d33e0ebd1fd'
+down_revision = '6125a904dfa3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('geofence_event',
+                    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+                    sa.Column('route_id', postgresql.UUID(as_uuid=True), nullable=False),
+                    sa.Column('fence', sa.Text(), nullable=False),
+                    sa.Column('driver_route_id', postgresql.UUID(as_uuid=True), nullable=False),
+                    sa.Column('event', sa.Text(), nullable=False),
+                    sa.Column('created_at', sa.DateTime(), nullable=False),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index('idx_geofence_event_driver', 'geofence_event', ['driver_route_id', 'route_id', 'fence', 'created_at'])
+
+
+def downgrade():
+    op.drop_index('idx_geofence_event_driver', table_name='geofence_event')
+    op.drop_table('geofence_event')
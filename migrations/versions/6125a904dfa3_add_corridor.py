@@ -0,0 +1,55 @@
+"""
+Message: Add corridor, fill it from the routes driven so far
+Revision ID: 6125a904dfa3
+Revises: e124d82ba34a
+Create Date: 2026-10-19 16:00:00.000000
+"""
+import geoalchemy2
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+revision = '6125a904dfa3'
+down_revision = 'e124d82ba34a'
+branch_labels = None
+depends_on = None
+
+CELL_SIZE = 1000  # Config.CORRIDOR_CELL_SIZE at the time of writing
+
+
+def upgrade():
+    op.create_table('corridor',
+                    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+                    sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+                    sa.Column('profile', sa.Text(), nullable=False),
+                    sa.Column('start_cell', sa.Text(), nullable=False),
+                    sa.Column('finish_cell', sa.Text(), nullable=False),
+                    sa.Column('route_id', postgresql.UUID(as_uuid=True), nullable=False),
+                    sa.Column('trip_count', sa.Integer(), nullable=False),
+                    sa.Column('updated_at', sa.DateTime(), nullable=False),
+                    sa.Column('distance', sa.Float(), nullable=True),
+                    sa.Column('duration', sa.Float(), nullable=True),
+                    sa.Column('geom', geoalchemy2.types.Geometry(geometry_type='LINESTRING', srid=32637, spatial_index=False, from_text='ST_GeomFromEWKT', name='geometry'), nullable=False),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('user_id', 'profile', 'start_cell', 'finish_cell')
+                    )
+    cell = "floor(ST_X({point}) / {size})::int || ':' || floor(ST_Y({point}) / {size})::int"
+    start_cell = cell.format(point='geom_start', size=CELL_SIZE)
+    finish_cell = cell.format(point='geom_finish', size=CELL_SIZE)
+    op.execute(f'''
+        INSERT INTO corridor (id, user_id, profile, start_cell, finish_cell, route_id, trip_count, updated_at, distance, duration, geom)
+        SELECT DISTINCT ON (user_id, profile, start_cell, finish_cell)
+            gen_random_uuid(), user_id, profile, start_cell, finish_cell, id,
+            count(*) OVER (PARTITION BY user_id, profile, start_cell, finish_cell),
+            created_at, distance, duration, geom
+        FROM (
+            SELECT *, {start_cell} AS start_cell, {finish_cell} AS finish_cell FROM route
+            WHERE is_handled AND trip_id IS NOT NULL AND geom IS NOT NULL
+        ) AS driven
+        ORDER BY user_id, profile, start_cell, finish_cell, created_at DESC
+    ''')
+
+
+def downgrade():
+    op.drop_table('corridor')
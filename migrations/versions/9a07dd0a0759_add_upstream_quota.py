@@ -0,0 +1,29 @@
+"""
+Message: Add upstream_quota
+Revision ID: 9a07dd0a0759
+Revises: 1d33e0ebd1fd
+Create Date: 2026-10-19 19:00:00.000000
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = '9a07dd0a0759'
+down_revision = '1d33e0ebd1fd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('upstream_quota',
+                    sa.Column('endpoint', sa.Text(), nullable=False),
+                    sa.Column('day', sa.Date(), nullable=False),
+                    sa.Column('used', sa.Integer(), nullable=False),
+                    sa.Column('tokens', sa.Float(), nullable=False),
+                    sa.Column('refilled_at', sa.Float(), nullable=False),
+                    sa.PrimaryKeyConstraint('endpoint', 'day')
+                    )
+
+
+def downgrade():
+    op.drop_table('upstream_quota')
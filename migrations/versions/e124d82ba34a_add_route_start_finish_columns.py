@@ -0,0 +1,40 @@
+"""
+Message: Add stored route start & finish, index them for the history lookup
+Revision ID: e124d82ba34a
+Revises: ea0101cd4ee0
+Create Date: 2026-10-19 14:00:00.000000
+"""
+import geoalchemy2
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = 'e124d82ba34a'
+down_revision = 'ea0101cd4ee0'
+branch_labels = None
+depends_on = None
+
+HISTORY_FILTER = sa.text('is_handled AND trip_id IS NOT NULL')
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.add_column('route', sa.Column('geom_start',
+                                     geoalchemy2.types.Geometry(geometry_type='POINT', srid=32637, spatial_index=False, from_text='ST_GeomFromEWKT', name='geometry'),
+                                     sa.Computed('ST_StartPoint(geom)'), nullable=True
+                                     ))
+    op.add_column('route', sa.Column('geom_finish',
+                                     geoalchemy2.types.Geometry(geometry_type='POINT', srid=32637, spatial_index=False, from_text='ST_GeomFromEWKT', name='geometry'),
+                                     sa.Computed('ST_EndPoint(geom)'), nullable=True
+                                     ))
+    op.create_index('idx_route_history_start', 'route', ['user_id', 'geom_start'], unique=False,
+                    postgresql_using='gist', postgresql_where=HISTORY_FILTER)
+    op.create_index('idx_route_history_finish', 'route', ['user_id', 'geom_finish'], unique=False,
+                    postgresql_using='gist', postgresql_where=HISTORY_FILTER)
+
+
+def downgrade():
+    op.drop_index('idx_route_history_finish', table_name='route', postgresql_using='gist')
+    op.drop_index('idx_route_history_start', table_name='route', postgresql_using='gist')
+    op.drop_column('route', 'geom_finish')
+    op.drop_column('route', 'geom_start')
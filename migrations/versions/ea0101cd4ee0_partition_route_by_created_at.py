@@ -0,0 +1,154 @@
+"""
+Message: Partition route, pickup_point & dropoff_point by month of route creation
+Revision ID: ea0101cd4ee0
+Revises: bd391440adb6
+Create Date: 2026-10-19 12:00:00.000000
+"""
+from datetime import date
+
+import geoalchemy2
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+revision = 'ea0101cd4ee0'
+down_revision = 'bd391440adb6'
+branch_labels = None
+depends_on = None
+
+PARTITION_KEYS = {'route': 'created_at', 'pickup_point': 'route_created_at', 'dropoff_point': 'route_created_at'}
+GIST_INDEXES = {
+    'idx_route_geom': ('route', 'geom'),
+    'idx_route_geom_remainder': ('route', 'geom_remainder'),
+    'idx_pickup_point_geom': ('pickup_point', 'geom'),
+    'idx_dropoff_point_geom': ('dropoff_point', 'geom'),
+}
+MONTHS_AHEAD = 2
+
+
+def month_start(day, months=0):
+    year, month = divmod(day.year * 12 + day.month - 1 + months, 12)
+    return date(year, month + 1, 1)
+
+
+def route_columns():
+    return [
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('trip_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('profile', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('distance', sa.Float(), nullable=True),
+        sa.Column('duration', sa.Float(), nullable=True),
+        sa.Column('geom', geoalchemy2.types.Geometry(geometry_type='LINESTRING', srid=32637, spatial_index=False, from_text='ST_GeomFromEWKT', name='geometry'), nullable=True),
+        sa.Column('geom_remainder', geoalchemy2.types.Geometry(geometry_type='LINESTRING', srid=32637, spatial_index=False, from_text='ST_GeomFromEWKT', name='geometry'), nullable=True),
+        sa.Column('is_handled', sa.Boolean(), nullable=False),
+    ]
+
+
+def point_columns():
+    return [
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('route_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('geom', geoalchemy2.types.Geometry(geometry_type='POINT', srid=32637, spatial_index=False, from_text='ST_GeomFromEWKT', name='geometry'), nullable=False),
+    ]
+
+
+def rename_away(table):
+    """Free the table's name & the names of its indexes for the new version of it."""
+    op.rename_table(table, f'{table}_old')
+    op.execute(f'ALTER INDEX IF EXISTS {table}_pkey RENAME TO {table}_old_pkey')
+    for index, (indexed_table, _) in GIST_INDEXES.items():
+        if indexed_table == table:
+            op.execute(f'DROP INDEX IF EXISTS {index}')
+
+
+def create_gist_indexes():
+    for index, (table, column) in GIST_INDEXES.items():
+        op.create_index(index, table, [column], unique=False, postgresql_using='gist')
+
+
+def upgrade():
+    for table in PARTITION_KEYS:
+        rename_away(table)
+    op.create_table(
+        'route',
+        *route_columns(),
+        sa.PrimaryKeyConstraint('id', 'created_at'),
+        sa.UniqueConstraint('trip_id', 'created_at'),
+        postgresql_partition_by='RANGE (created_at)'
+    )
+    for table in 'pickup_point', 'dropoff_point':
+        op.create_table(
+            table,
+            *point_columns(),
+            sa.Column('route_created_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(
+                ['route_id', 'route_created_at'], ['route.id', 'route.created_at'],
+                name=f'{table}_route_fkey', ondelete='CASCADE'
+            ),
+            sa.PrimaryKeyConstraint('id', 'route_created_at'),
+            sa.UniqueConstraint('route_id', 'route_created_at'),
+            postgresql_partition_by='RANGE (route_created_at)'
+        )
+    # Monthly partitions for all the existing data & a couple of months ahead
+    first_route_at = op.get_bind().execute(sa.text('SELECT min(created_at) FROM route_old')).scalar()
+    month = month_start(first_route_at or date.today())
+    last_month = month_start(date.today(), MONTHS_AHEAD)
+    while month <= last_month:
+        for table in PARTITION_KEYS:
+            op.execute(
+                f'CREATE TABLE {table}_p{month:%Y_%m} PARTITION OF {table} '
+                f"FOR VALUES FROM ('{month}') TO ('{month_start(month, 1)}')"
+            )
+        month = month_start(month, 1)
+    # Archived months leave the routes still in use behind; those are kept here
+    for table in PARTITION_KEYS:
+        op.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+    op.execute(
+        'INSERT INTO route (id, user_id, trip_id, profile, created_at, distance, duration, geom, geom_remainder, is_handled) '
+        'SELECT id, user_id, trip_id, profile, created_at, distance, duration, geom, geom_remainder, is_handled FROM route_old'
+    )
+    for table in 'pickup_point', 'dropoff_point':
+        op.execute(
+            f'INSERT INTO {table} (id, route_id, created_at, geom, route_created_at) '
+            f'SELECT point.id, point.route_id, point.created_at, point.geom, route.created_at '
+            f'FROM {table}_old AS point JOIN route ON route.id = point.route_id'
+        )
+    for table in reversed(list(PARTITION_KEYS)):
+        op.drop_table(f'{table}_old')
+    create_gist_indexes()
+
+
+def downgrade():
+    for table in PARTITION_KEYS:
+        rename_away(table)
+    op.create_table(
+        'route',
+        *route_columns(),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('trip_id')
+    )
+    for table in 'pickup_point', 'dropoff_point':
+        op.create_table(
+            table,
+            *point_columns(),
+            sa.ForeignKeyConstraint(['route_id'], ['route.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('route_id')
+        )
+    op.execute(
+        'INSERT INTO route (id, user_id, trip_id, profile, created_at, distance, duration, geom, geom_remainder, is_handled) '
+        'SELECT id, user_id, trip_id, profile, created_at, distance, duration, geom, geom_remainder, is_handled FROM route_old'
+    )
+    for table in 'pickup_point', 'dropoff_point':
+        op.execute(
+            f'INSERT INTO {table} (id, route_id, created_at, geom) '
+            f'SELECT id, route_id, created_at, geom FROM {table}_old'
+        )
+    # Dropping the partitioned parents drops their partitions as well
+    for table in reversed(list(PARTITION_KEYS)):
+        op.drop_table(f'{table}_old')
+    create_gist_indexes()
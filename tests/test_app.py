@@ -1,13 +1,21 @@
+import gzip
+import json
+import time
+import threading
 from uuid import uuid4
 
 import pytest
+import requests
+import numpy as np
 from shapely.geometry import LineString, Point
 from shapely.affinity import translate
 from geoalchemy2.shape import to_shape
 
-from app import app
-from app.helpers import to_wgs84, project
-from app.models import db, Route, PickupPoint, DropoffPoint
+from app import app, ors, deadline, singleflight, quota
+from app.grid import GridIndex
+from app.helpers import to_wgs84, project, insert_routes
+from app.validation import truncated, min_items
+from app.models import db, Route, PickupPoint, DropoffPoint, Corridor, UpstreamQuota
 
 
 POSITIONS = [  # HEIDELBERG
@@ -69,7 +77,7 @@ def client():
     with app.test_client() as client:
         yield client
     # # Clear the DB
-    for model in (Route, PickupPoint, DropoffPoint):
+    for model in (Route, PickupPoint, DropoffPoint, Corridor, UpstreamQuota):
         model.query.delete()
         db.session.commit()
 
@@ -255,6 +263,30 @@ def test_routes_prepared_distant_finish(client):
     assert len(response['prepared_routes']['features']) == 0
 
 
+def test_routes_prepared_corridor(client):
+    """Confirming a trip along a handled route makes it a corridor to be reused."""
+    user_id = uuid4()
+    positions = POSITIONS[:2]
+    route = prepare_route('driving-car', user_id=user_id, positions=positions, is_handled=True)
+    trip_id = str(uuid4())
+    for _ in range(2):  # the same trip confirmed again isn't counted twice
+        assert client.put(f'/routes/{route.id}', json={'trip_id': trip_id}).status_code == 204
+    assert [corridor.trip_count for corridor in Corridor.query.filter(Corridor.route_id == route.id)] == [1]
+    body = {
+        'positions': positions,
+        'profile': 'driving-car',
+        'user_id': user_id,
+        'alternatives': True,
+        'handles': False,
+        'make_route': True
+    }
+    response = client.post('/routes', json=body).get_json()
+    assert len(response['prepared_routes']['features']) == 1
+    # Cut to & extended to the requested positions, as routes from the history are
+    start = response['prepared_routes']['features'][0]['geometry']['coordinates'][0]
+    assert project(Point(start)).distance(project(Point(positions[0][::-1]))) < 50
+
+
 def test_get_route(client):
     """A route can be retrieved from the DB by its UUID."""
     route_in = prepare_route('driving-car', positions=POSITIONS)
@@ -264,3 +296,186 @@ def test_get_route(client):
     assert str(route_in.id) == route_out['id']
     for attr in ('profile', 'user_id', 'distance', 'duration'):
         assert str(route_out['properties'][attr]) == str(getattr(route_in, attr))  # to serialize UUID
+
+
+def test_route_start_finish_stored(client):
+    """Route endpoints are stored alongside the route for indexed history lookups."""
+    route = prepare_route('driving-car', positions=POSITIONS)
+    geom = to_shape(route.geom)
+    assert to_shape(route.geom_start).equals(Point(geom.coords[0]))
+    assert to_shape(route.geom_finish).equals(Point(geom.coords[-1]))
+
+
+def test_insert_routes(client):
+    """Routes inserted in one statement keep their attributes, their remainder being the whole route."""
+    geom = project(LineString([position[::-1] for position in POSITIONS]))
+    routes = [
+        {'id': uuid4(), 'user_id': uuid4(), 'profile': profile, 'geom': geom}
+        for profile in ('driving-car', 'foot-walking')
+    ]
+    with app.test_request_context():
+        insert_routes(routes)
+        db.session.commit()
+    for attrs in routes:
+        route = Route.query.get(attrs['id'])
+        assert (route.user_id, route.profile) == (attrs['user_id'], attrs['profile'])
+        assert to_shape(route.geom_remainder).equals(to_shape(route.geom))
+        assert to_shape(route.geom).equals_exact(geom, 1e-6)
+
+
+def test_metrics(client):
+    """Request latencies are exposed in the Prometheus format."""
+    client.get('/')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert b'geo_request_duration_seconds' in response.data
+
+
+def test_stops_compressed(client):
+    """Static layers are sent compressed to clients accepting that, & the same data otherwise."""
+    plain = client.get('/stops')
+    compressed = client.get('/stops', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in plain.headers
+    assert json.loads(gzip.decompress(compressed.data)) == plain.get_json()
+
+
+def test_stops_not_modified(client):
+    """Clients that have the current static layer get a 304 w/out the data."""
+    response = client.get('/stops')
+    etag = response.headers['ETag']
+    response = client.get('/stops', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert not response.data
+
+
+def test_batch_get_routes(client):
+    """Many routes are fetched at once, in the requested order, w/ the requested fields only."""
+    routes = [prepare_route('foot-walking'), prepare_route('driving-car')]
+    client.post(f'/routes/{routes[1].id}/remainder', json={'position': POSITIONS[1]})
+    route_ids = [str(routes[1].id), str(uuid4()), str(routes[0].id)]
+    response = client.post('/routes:batch-get', json={'route_ids': route_ids, 'fields': ['geom_remainder']})
+    assert response.status_code == 200
+    features = response.get_json()['features']
+    assert [feature['id'] for feature in features] == [route_ids[0], route_ids[2]]
+    assert features[0]['geometry'] is None
+    assert features[0]['properties']['geom_remainder']['type'] == 'LineString'
+    assert features[1]['properties']['geom_remainder'] is None
+    assert client.post('/routes:batch-get', json={'route_ids': route_ids, 'fields': []}).status_code == 400
+
+
+def test_route_events(client):
+    """A route's event stream starts w/ its current state."""
+    route = prepare_route('foot-walking')
+    client.post(f'/routes/{route.id}/remainder', json={'position': POSITIONS[1]})
+    response = client.get(f'/routes/{route.id}/events')
+    assert response.mimetype == 'text/event-stream'
+    assert next(response.response).startswith(b'event: remainder\ndata: {')
+    response.close()
+
+
+def test_passenger_arrived_at_dropoff(client):
+    """A passenger w/ a drop-off point arrives there, not anywhere along their route."""
+    route = prepare_route('foot-walking')
+    client.post(f'/routes/{route.id}/dropoff_point', json={'position': POSITIONS[-1]})
+    for position, arrived in ((POSITIONS[0], False), (POSITIONS[-1], True)):
+        response = client.get(
+            f'/routes/{route.id}/is_passenger_arrived', query_string={'position': '{},{}'.format(*position)}
+        )
+        assert response.get_json() is arrived
+
+
+def test_batch_geocode(client):
+    """Texts are geocoded in the order given, w/ duplicates resolved once & errors reported per text."""
+    items = [{'text': 'Тверская 1'}, {'text': 'zzqxjvw qqxz'}, {'text': ' Тверская  1 '}]
+    response = client.post('/geocode:batch', json={'items': items})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert len(results) == 3
+    assert results[0]['type'] == 'Feature' and results[0] == results[2]
+    assert results[1]['error']['status'] == 404
+
+
+def test_upstream_calls_coalesced():
+    """Identical concurrent calls share one call upstream, & each caller gets a result of their own."""
+    calls = []
+
+    @singleflight.coalesced('ors')
+    def slow_call(text):
+        calls.append(text)
+        time.sleep(.2)
+        return {'text': text}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(slow_call('Тверская 1'))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ['Тверская 1']
+    assert results == [{'text': 'Тверская 1'}] * 3
+    assert results[0] is not results[1]
+
+
+def test_upstream_quota(client):
+    """Calls are let through while there are tokens in the bucket & calls left in the day's quota."""
+    assert [quota.acquire('test', rate=0, burst=2, daily=5) for _ in range(3)] == [True, True, False]
+    assert quota.remaining({'test': 5}) == {'test': 3}
+    quota.exhaust('test', 5)
+    assert quota.remaining({'test': 5}) == {'test': 0}
+
+
+def test_upstream_quota_reserved(client):
+    """Workers reserve calls in batches & make them w/out going to the DB, down to the last ones of the day."""
+    assert [quota.spend('test_batch', rate=0, burst=10, daily=5, batch=4) for _ in range(6)] == [True] * 5 + [False]
+    assert quota.remaining({'test_batch': 5}) == {'test_batch': 0}
+
+
+def test_upstream_budget_spent(client):
+    """A request that's out of time for upstream calls fails right away w/ a 504."""
+    app.config['UPSTREAM_BUDGETS']['geocode'] = 0
+    try:
+        response = client.get('/geocode', query_string={'text': 'Тверская 1'})
+    finally:
+        del app.config['UPSTREAM_BUDGETS']['geocode']
+    assert response.status_code == 504
+
+
+@pytest.mark.parametrize('rumap_fails', ['quota', '403'])
+def test_rumap_falls_back_to_ors(client, monkeypatch, rumap_fails):
+    """Texts are geocoded by ORS while rumap's quota is used up, or once it says so."""
+    monkeypatch.setitem(app.config, 'GEO_ENGINE', 'rumap')
+    if rumap_fails == 'quota':
+        monkeypatch.setitem(app.config['RUMAP_DAILY_QUOTAS'], 'forward', 0)
+    else:
+        forbidden = requests.Response()
+        forbidden.status_code = 403
+        monkeypatch.setattr(deadline, 'send', lambda *args, **kwargs: forbidden)
+    feature = {'id': 1, 'geometry': {'type': 'Point', 'coordinates': [37.6, 55.75]}, 'properties': {}}
+    monkeypatch.setattr(ors, 'geocode', lambda text, focus: feature)
+    response = client.get('/geocode', query_string={'text': 'Тверская 1'})
+    assert response.status_code == 200
+    assert response.get_json()['geometry'] == feature['geometry']
+
+
+def test_grid_index():
+    """Points within a radius, nearest ones & ones in a box are the same as found by brute force."""
+    coords = np.random.default_rng(0).uniform(0, 5000, (500, 2))
+    index = GridIndex(coords, 300)
+    x, y = 2500, 1200
+    distances = np.hypot(*(coords - (x, y)).T)
+    assert list(index.within(x, y, 700)) == [i for i in np.argsort(distances, kind='stable') if distances[i] <= 700]
+    assert list(index.nearest(x, y, 5)) == list(np.argsort(distances, kind='stable')[:5])
+    assert sorted(index.in_bbox(1000, 1000, 2000, 3000)) == [
+        i for i, (px, py) in enumerate(coords) if 1000 <= px <= 2000 and 1000 <= py <= 3000
+    ]
+    assert len(index.in_bbox(-10 ** 9, -10 ** 9, 10 ** 9, 10 ** 9)) == len(coords)  # w/out a loop per column
+    assert not len(index.in_bbox(6000, 6000, 7000, 7000))
+
+
+def test_validation_keeps_min_items():
+    """Arrays are only cut down to as many items as the response schema requires of any of them."""
+    schema = {'type': 'array', 'items': {'type': 'array', 'minItems': 2, 'items': {'type': 'number'}}, 'minItems': 1}
+    coordinates = [[55.76, 37.57], [55.75, 37.61], [55.75, 37.62]]
+    assert truncated(coordinates, max(1, min_items(schema))) == coordinates[:2]
+    assert truncated(coordinates, 0) == coordinates